@@ -17,6 +17,10 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # Normalize upload extensions once so allowed_file never has to lower the config side
+    if app.config.get('ALLOWED_EXTENSIONS'):
+        app.config['ALLOWED_EXTENSIONS'] = frozenset(ext.lower() for ext in app.config['ALLOWED_EXTENSIONS'])
+    
     # Configure session to use Redis
     app.config['SESSION_TYPE'] = 'redis'
     if app.config.get('REDIS_URL'):
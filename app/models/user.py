@@ -198,6 +198,13 @@ class User(UserMixin):
         self._can_update_shipments = user_data.get('Can_Update_Shipments__c', True)
         self._can_upload_documents = user_data.get('Can_Upload_Documents__c', True)
         self._can_view_analytics = user_data.get('Can_View_Analytics__c', False)
+        self._permissions = frozenset(
+            name for name, granted in (
+                ('update_shipments', self._can_update_shipments),
+                ('upload_documents', self._can_upload_documents),
+                ('view_analytics', self._can_view_analytics)
+            ) if granted
+        )
 
         self._user_data = user_data
     
@@ -227,8 +234,11 @@ class User(UserMixin):
     
     def has_permission(self, permission: str) -> bool:
         """Check if user has a specific permission."""
-        permission_attr = f"_can_{permission}"
-        return getattr(self, permission_attr, False)
+        return permission in self._permissions
+    
+    def get_permission_set(self) -> frozenset:
+        """All permissions granted to the user."""
+        return self._permissions
     
     def to_dict(self) -> dict:
         """Convert user object to a dictionary for API responses."""
@@ -65,16 +65,10 @@ def get_shipments():
         status = sanitize_input(request.args.get('status'), 50)
         search = sanitize_input(request.args.get('search'), 100)
         
-        # Get shipments from Salesforce
+        # Get shipments from Salesforce merged with real-time data from Firebase
         limit = min(per_page * 5, 500)  # Get more data for filtering
-        shipments = salesforce_service.get_carrier_shipments(carrier_id, limit=limit)
-        
-        # Get real-time data from Firebase
-        realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
-        
-        # Merge data
-        from app.routes.dashboard import merge_shipment_data
-        merged_shipments = merge_shipment_data(shipments, realtime_data)
+        from app.routes.dashboard import load_merged_shipments
+        merged_shipments = load_merged_shipments(carrier_id, limit=limit)
         
         # Apply filters
         filtered_shipments = []
@@ -144,8 +138,8 @@ def get_shipment(shipment_id):
         carrier_id = session.get('carrier_id')
         shipment_id = sanitize_input(shipment_id, 255)
         
-        # Get shipment from Salesforce
-        shipment = salesforce_service.get_shipment_details(shipment_id)
+        # Get shipment and its stages from Salesforce in one round trip
+        shipment, stages = salesforce_service.get_shipment_with_stages(shipment_id)
         
         if not shipment:
             return jsonify(create_error_response('Shipment not found', 404)), 404
@@ -157,9 +151,6 @@ def get_shipment(shipment_id):
         # Get real-time tracking data
         tracking_data = firebase_service.get_shipment_tracking(shipment_id)
         
-        # Get shipment stages
-        stages = salesforce_service.get_shipment_stages(shipment.get('Id'))
-        
         # Get documents
         documents = firebase_service.get_shipment_documents(shipment_id)
         
@@ -362,6 +353,15 @@ def bulk_status_update():
         results = []
         successful_updates = 0
         failed_updates = 0
+        pending = []  # (results index, shipment_id, Salesforce record Id, update)
+        
+        # Look up every shipment concurrently up front instead of one round trip per update
+        lookup_ids = [
+            sanitize_input(update.get('shipment_id'), 255)
+            for update in updates
+            if isinstance(update, dict) and isinstance(update.get('shipment_id'), str)
+        ]
+        shipments = salesforce_service.get_shipments_details([sid for sid in lookup_ids if sid])
         
         for update in updates:
             try:
@@ -378,7 +378,7 @@ def bulk_status_update():
                     continue
                 
                 # Verify shipment belongs to carrier
-                shipment = salesforce_service.get_shipment_details(shipment_id)
+                shipment = shipments.get(shipment_id)
                 if not shipment or shipment.get('TFST_Carrier__c') != carrier_id:
                     results.append({
                         'shipment_id': shipment_id,
@@ -388,43 +388,9 @@ def bulk_status_update():
                     failed_updates += 1
                     continue
                 
-                # Update status
-                location = update.get('location')
-                driver_info = update.get('driver_info')
-                
-                sf_success = salesforce_service.update_shipment_status(
-                    shipment_id, status, location, driver_info
-                )
-                
-                # Update Firebase
-                tracking_data = {
-                    'status': status,
-                    'carrier_id': carrier_id,
-                    'timestamp': datetime.now(timezone.utc).isoformat(),
-                    'notes': update.get('notes', '')
-                }
-                
-                if location:
-                    tracking_data['location'] = location
-                if driver_info:
-                    tracking_data['driver_info'] = driver_info
-                
-                fb_success = firebase_service.update_shipment_tracking(shipment_id, tracking_data)
-                
-                if sf_success:
-                    successful_updates += 1
-                    results.append({
-                        'shipment_id': shipment_id,
-                        'success': True,
-                        'status': status
-                    })
-                else:
-                    failed_updates += 1
-                    results.append({
-                        'shipment_id': shipment_id,
-                        'success': False,
-                        'error': 'Failed to update Salesforce'
-                    })
+                # Result is filled in once the batched Salesforce write returns
+                results.append(None)
+                pending.append((len(results) - 1, shipment_id, shipment['Id'], update))
                 
             except Exception as e:
                 failed_updates += 1
@@ -434,6 +400,71 @@ def bulk_status_update():
                     'error': str(e)
                 })
         
+        # Update Salesforce in as few sObject Collection calls as possible
+        sf_results = salesforce_service.update_shipments_status_bulk([
+            {
+                'shipment_id': record_id,
+                'status': sanitize_input(update.get('status'), 50),
+                'location': update.get('location'),
+                'driver_info': update.get('driver_info')
+            }
+            for _, _, record_id, update in pending
+        ]) if pending else []
+        
+        timestamp = datetime.now(timezone.utc).isoformat()
+        tracking_events = []  # (Salesforce record Id, event data) for successful updates
+        
+        for (index, shipment_id, record_id, update), sf_success in zip(pending, sf_results):
+            status = sanitize_input(update.get('status'), 50)
+            location = update.get('location')
+            driver_info = update.get('driver_info')
+            
+            # Update Firebase
+            tracking_data = {
+                'status': status,
+                'carrier_id': carrier_id,
+                'timestamp': timestamp,
+                'notes': update.get('notes', '')
+            }
+            
+            if location:
+                tracking_data['location'] = location
+            if driver_info:
+                tracking_data['driver_info'] = driver_info
+            
+            try:
+                firebase_service.update_shipment_tracking(shipment_id, tracking_data)
+            except Exception as e:
+                logger.error(f"Firebase update failed for {shipment_id}: {str(e)}")
+            
+            if sf_success:
+                successful_updates += 1
+                tracking_events.append((record_id, {
+                    'status': status,
+                    'timestamp': timestamp,
+                    'location': location,
+                    'notes': update.get('notes', '')
+                }))
+                results[index] = {
+                    'shipment_id': shipment_id,
+                    'success': True,
+                    'status': status
+                }
+            else:
+                failed_updates += 1
+                results[index] = {
+                    'shipment_id': shipment_id,
+                    'success': False,
+                    'error': 'Failed to update Salesforce'
+                }
+        
+        # Record tracking history like single updates do, 200 records per call
+        if tracking_events:
+            try:
+                salesforce_service.create_tracking_records_bulk(tracking_events)
+            except Exception as e:
+                logger.error(f"Bulk tracking record creation failed: {str(e)}")
+        
         # Log bulk activity
         log_user_activity(current_user.id, 'bulk_status_update', 
                          f'Updated {successful_updates} shipments, {failed_updates} failed')
@@ -5,12 +5,13 @@ Salesforce OAuth integration with user data stored in Salesforce.
 from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models.user import User
-from app.services.salesforce_service import salesforce_service
+from app.services.salesforce_service import salesforce_service, ACCESS_TOKEN_LIFETIME
 from app.services.user_service import user_service
 from app import login_manager
 import secrets
+import time
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 
 auth_bp = Blueprint('auth', __name__)
 logger = logging.getLogger(__name__)
@@ -63,14 +64,14 @@ def oauth_callback():
         session['sf_instance_url'] = token_response['instance_url']
         if 'refresh_token' in token_response:
             session['sf_refresh_token'] = token_response['refresh_token']
-        session['sf_access_token_expires_at'] = (datetime.utcnow() + timedelta(hours=2)).isoformat()
+        session['sf_access_token_expires_ts'] = int(time.time()) + ACCESS_TOKEN_LIFETIME
         
         # Get user information from Salesforce
         user_info = salesforce_service.get_user_info(session['sf_access_token'], session['sf_instance_url'])
         salesforce_user_id = user_info.get('user_id')
 
         # Check if user is associated with a carrier
-        carrier_info = salesforce_service.get_carrier_info(salesforce_user_id)
+        carrier_info = salesforce_service.get_carrier_info(salesforce_user_id, user_info.get('email'))
         if not carrier_info or not carrier_info.get('Is_Active__c'):
             flash('Your carrier account is inactive or not found. Please contact your administrator.', 'error')
             return redirect(url_for('auth.login'))
@@ -83,7 +84,7 @@ def oauth_callback():
             'name': user_info.get('name'),
             'company_name': carrier_info.get('Name'),
             'phone_number': carrier_info.get('TFST_Contact_Number__c'),
-            'last_login': datetime.utcnow().isoformat()
+            'last_login': datetime.now(timezone.utc).isoformat()
         }
         
         portal_user = user_service.create_or_update_user(user_data_to_save)
@@ -76,7 +76,7 @@ def oauth_callback_debug():
             # Try to get carrier info (but don't fail if it doesn't work)
             logger.info("Getting carrier info...")
             try:
-                carrier_info = salesforce_service.get_carrier_info(user_info.get('user_id'))
+                carrier_info = salesforce_service.get_carrier_info(user_info.get('user_id'), user_info.get('email'))
                 logger.info(f"Carrier info: {bool(carrier_info)}")
                 if carrier_info:
                     logger.info(f"Carrier: {carrier_info.get('Name')}")
@@ -4,10 +4,11 @@ Main carrier dashboard with shipment overview and KPIs
 """
 from flask import Blueprint, render_template, request, jsonify, session, current_app
 from flask_login import login_required, current_user
-from app.services.salesforce_service import salesforce_service
+from app.services.salesforce_service import salesforce_service, SHIPMENT_FIELDS, SHIPMENT_KPI_FIELDS, SHIPMENT_SUMMARY_FIELDS, SHIPMENT_LIST_FIELDS
 from app.utils.decorators import salesforce_token_required
 from app.services.firebase_service import firebase_service
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -30,14 +31,9 @@ def index():
             print("DEBUG: No carrier_id in session, redirecting to login")
             return redirect(url_for('auth.login'))
         
-        # Get carrier's active shipments from Salesforce
-        shipments = salesforce_service.get_carrier_shipments(carrier_id)
-        
-        # Get real-time tracking data from Firebase
-        realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
-        
-        # Merge Salesforce and Firebase data
-        merged_shipments = merge_shipment_data(shipments, realtime_data)
+        # Get carrier's active shipments from Salesforce merged with Firebase tracking data;
+        # the dashboard table and KPIs only read the KPI columns
+        merged_shipments = load_merged_shipments(carrier_id, fields=SHIPMENT_KPI_FIELDS)
         
         # Calculate KPIs
         kpis = calculate_dashboard_kpis(merged_shipments)
@@ -77,12 +73,8 @@ def get_kpis():
     try:
         carrier_id = session.get('carrier_id')
         
-        # Get shipments
-        shipments = salesforce_service.get_carrier_shipments(carrier_id, limit=200)
-        realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
-        
-        # Merge and calculate KPIs
-        merged_shipments = merge_shipment_data(shipments, realtime_data)
+        # Get merged shipments and calculate KPIs
+        merged_shipments = load_merged_shipments(carrier_id, limit=200, fields=SHIPMENT_KPI_FIELDS)
         kpis = calculate_dashboard_kpis(merged_shipments)
         
         return jsonify({
@@ -104,15 +96,11 @@ def get_shipments_summary():
     """API endpoint for shipments summary"""
     try:
         carrier_id = session.get('carrier_id')
-        limit = request.args.get('limit', 50, type=int)
+        limit = min(request.args.get('limit', 50, type=int), 500)
         status_filter = request.args.get('status')
         
-        # Get shipments
-        shipments = salesforce_service.get_carrier_shipments(carrier_id, limit=limit)
-        realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
-        
-        # Merge data
-        merged_shipments = merge_shipment_data(shipments, realtime_data)
+        # Get merged shipment data
+        merged_shipments = load_merged_shipments(carrier_id, limit=limit, fields=SHIPMENT_SUMMARY_FIELDS)
         
         # Apply status filter if provided
         if status_filter:
@@ -181,10 +169,13 @@ def alerts():
     try:
         carrier_id = session.get('carrier_id')
         
+        # One Salesforce query feeds all three alert lists
+        shipments = salesforce_service.get_carrier_shipments(carrier_id, fields=SHIPMENT_LIST_FIELDS)
+        
         # Get urgent shipments and alerts
-        urgent_shipments = get_urgent_shipments(carrier_id)
-        delayed_shipments = get_delayed_shipments(carrier_id)
-        delivery_alerts = get_delivery_alerts(carrier_id)
+        urgent_shipments = get_urgent_shipments(carrier_id, shipments)
+        delayed_shipments = get_delayed_shipments(carrier_id, shipments)
+        delivery_alerts = get_delivery_alerts(carrier_id, shipments)
         
         return render_template(
             'dashboard/alerts.html',
@@ -210,8 +201,9 @@ def analytics():
         carrier_id = session.get('carrier_id')
         
         # Get analytics data for different time periods
-        performance_30d = salesforce_service.get_carrier_performance_metrics(carrier_id, 30)
-        performance_90d = salesforce_service.get_carrier_performance_metrics(carrier_id, 90)
+        performance = salesforce_service.get_carrier_performance_by_period(carrier_id, [30, 90])
+        performance_30d = performance[30]
+        performance_90d = performance[90]
         
         # Calculate trends
         analytics_data = {
@@ -230,6 +222,23 @@ def analytics():
 
 # Helper Functions
 
+# Runs the Salesforce half of Salesforce/Firebase fan-outs
+_fanout_executor = ThreadPoolExecutor(max_workers=8)
+
+def load_merged_shipments(carrier_id, limit=100, fields=SHIPMENT_FIELDS):
+    """Fetch Salesforce shipments and Firebase tracking data concurrently, then merge them"""
+    app = current_app._get_current_object()
+    
+    def fetch_salesforce():
+        with app.app_context():
+            return salesforce_service.get_carrier_shipments(carrier_id, limit=limit, fields=fields)
+    
+    # Salesforce runs on a worker while Firebase runs here, so wall time is the slower of the two
+    shipments_future = _fanout_executor.submit(fetch_salesforce)
+    realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
+    
+    return merge_shipment_data(shipments_future.result(), realtime_data)
+
 def merge_shipment_data(salesforce_shipments, firebase_data):
     """Merge Salesforce and Firebase shipment data"""
     try:
@@ -356,10 +365,11 @@ def get_recent_updates(carrier_id, hours=24):
         logger.error(f"Error getting recent updates: {str(e)}")
         return []
 
-def get_urgent_shipments(carrier_id):
-    """Get urgent/priority shipments"""
+def get_urgent_shipments(carrier_id, shipments=None):
+    """Get urgent/priority shipments, from `shipments` when already fetched"""
     try:
-        shipments = salesforce_service.get_carrier_shipments(carrier_id)
+        if shipments is None:
+            shipments = salesforce_service.get_carrier_shipments(carrier_id)
         
         urgent = []
         for shipment in shipments:
@@ -374,10 +384,11 @@ def get_urgent_shipments(carrier_id):
         logger.error(f"Error getting urgent shipments: {str(e)}")
         return []
 
-def get_delayed_shipments(carrier_id):
-    """Get delayed shipments"""
+def get_delayed_shipments(carrier_id, shipments=None):
+    """Get delayed shipments, from `shipments` when already fetched"""
     try:
-        shipments = salesforce_service.get_carrier_shipments(carrier_id)
+        if shipments is None:
+            shipments = salesforce_service.get_carrier_shipments(carrier_id)
         today = datetime.now().date()
         
         delayed = []
@@ -399,11 +410,12 @@ def get_delayed_shipments(carrier_id):
         logger.error(f"Error getting delayed shipments: {str(e)}")
         return []
 
-def get_delivery_alerts(carrier_id):
-    """Get upcoming delivery alerts"""
+def get_delivery_alerts(carrier_id, shipments=None):
+    """Get upcoming delivery alerts, from `shipments` when already fetched"""
     try:
         # Get shipments due in next 2 days
-        shipments = salesforce_service.get_carrier_shipments(carrier_id)
+        if shipments is None:
+            shipments = salesforce_service.get_carrier_shipments(carrier_id)
         tomorrow = (datetime.now() + timedelta(days=1)).date()
         day_after = (datetime.now() + timedelta(days=2)).date()
         
@@ -4,11 +4,10 @@ Shipment management, tracking, and document upload functionality
 """
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from app.services.salesforce_service import salesforce_service
+from app.services.salesforce_service import salesforce_service, SHIPMENT_LIST_FIELDS
 from app.services.firebase_service import firebase_service
 # from app.services.s3_service import s3_service
-from app.utils.helpers import allowed_file, validate_file_upload
+from app.utils.helpers import allowed_file, validate_file_upload, sniff_csv
 from app.utils.decorators import salesforce_token_required
 from datetime import datetime, timezone
 import logging
@@ -31,28 +30,23 @@ def index():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 25, type=int)
         
-        # Get shipments from Salesforce
-        shipments = salesforce_service.get_carrier_shipments(carrier_id, limit=200)
-        
-        # Get real-time data from Firebase
-        realtime_data = firebase_service.get_carrier_shipments_realtime(carrier_id)
-        
-        # Merge data
-        from app.routes.dashboard import merge_shipment_data
-        merged_shipments = merge_shipment_data(shipments, realtime_data)
-        
-        # Apply filters
-        if status_filter:
-            merged_shipments = [s for s in merged_shipments if s.get('status') == status_filter]
-        
-        if search_query:
-            merged_shipments = [s for s in merged_shipments 
-                              if (search_query.lower() in s.get('Name', '').lower() or
-                                  search_query.lower() in s.get('TFST_Project_Reference__c', '').lower())]
-        
+        # Get shipments from Salesforce merged with real-time data from Firebase
+        from app.routes.dashboard import load_merged_shipments
+        merged_shipments = load_merged_shipments(carrier_id, limit=200, fields=SHIPMENT_LIST_FIELDS)
+        
+        # Apply filters in a single pass, lowercasing the search term once
+        if status_filter or search_query:
+            search_lc = search_query.lower()
+            merged_shipments = [
+                s for s in merged_shipments
+                if (not status_filter or s.get('status') == status_filter) and
+                   (not search_lc or
+                    search_lc in (s.get('Name') or '').lower() or
+                    search_lc in (s.get('TFST_Project_Reference__c') or '').lower())
+            ]
+
         # Get unique statuses for filter dropdown
-        all_statuses = list(set([s.get('status') for s in merged_shipments if s.get('status')]))
-        all_statuses.sort()
+        all_statuses = sorted({s.get('status') for s in merged_shipments if s.get('status')})
         
         # Pagination (simple implementation)
         total_shipments = len(merged_shipments)
@@ -91,8 +85,8 @@ def index():
 def detail(shipment_id):
     """Display detailed shipment information"""
     try:
-        # Get shipment details from Salesforce
-        shipment = salesforce_service.get_shipment_details(shipment_id)
+        # Get shipment details and stages from Salesforce in one round trip
+        shipment, shipment_stages = salesforce_service.get_shipment_with_stages(shipment_id)
         
         if not shipment:
             flash('Shipment not found.', 'error')
@@ -104,25 +98,16 @@ def detail(shipment_id):
             flash('You do not have access to this shipment.', 'error')
             return redirect(url_for('shipments.index'))
         
-        # Get real-time tracking data from Firebase
-        tracking_data = firebase_service.get_shipment_tracking(shipment_id)
-        
-        # Get status history from Firebase
-        status_history = firebase_service.get_shipment_history(shipment_id)
-        
-        # Get shipment stages from Salesforce
-        shipment_stages = salesforce_service.get_shipment_stages(shipment.get('Id'))
-        
-        # Get documents from Firebase
-        documents = firebase_service.get_shipment_documents(shipment_id)
+        # Get tracking data, status history and documents from Firebase
+        firebase_data = firebase_service.get_shipment_bundle(shipment_id)
         
         return render_template(
             'shipments/detail.html',
             shipment=shipment,
-            tracking_data=tracking_data,
-            status_history=status_history,
+            tracking_data=firebase_data['tracking'],
+            status_history=firebase_data['history'],
             shipment_stages=shipment_stages,
-            documents=documents
+            documents=firebase_data['documents']
         )
         
     except Exception as e:
@@ -364,14 +349,14 @@ def upload_csv():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        if not file.filename.lower().endswith('.csv'):
+        # Sniff the content rather than trusting the extension
+        if not sniff_csv(file):
             return jsonify({'success': False, 'error': 'Only CSV files are allowed'}), 400
         
         carrier_id = session.get('carrier_id')
-        filename = secure_filename(file.filename)
         
-        # Upload to S3
-        upload_result = s3_service.upload_csv_to_s3(carrier_id, file, filename)
+        # Upload to S3 (filename is normalized by the service)
+        upload_result = s3_service.upload_csv_to_s3(carrier_id, file, file.filename)
         
         if not upload_result['success']:
             return jsonify({'success': False, 'error': upload_result.get('error')}), 500
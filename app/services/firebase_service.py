@@ -5,15 +5,69 @@ Direct Firebase connection for real-time shipment tracking and document storage
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from flask import current_app
-import json
 import logging
+import os
+import threading
 from datetime import datetime, timezone
 from typing import Dict, List, Optional, Any
 import uuid
+from urllib.parse import quote, unquote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from werkzeug.utils import secure_filename
+from app.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+def _debug_traceback() -> bool:
+    """Tracebacks are expensive to format; attach them only when DEBUG is on"""
+    return logger.isEnabledFor(logging.DEBUG)
+
+# Concurrent batch commits for bulk updates (client is thread-safe)
+BATCH_COMMIT_WORKERS = 40
+
+# Concurrent independent calls (page reads, delete fan-out)
+FANOUT_WORKERS = 16
+
+# Resumable upload chunk size for documents (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Read cache lifetimes in seconds
+TRACKING_CACHE_TTL = 30
+DOCUMENTS_CACHE_TTL = 300
+
+# Tracking fields compared with the cached tracking document; only the ones that changed
+# are sent, and an update that changes none of them is not written
+DEDUP_FIELDS = ('current_status', 'carrier_id', 'location', 'driver_info', 'notes')
+
+# Status history entries kept on each tracking document (Firestore caps documents at 1 MiB),
+# trimmed in the background every HISTORY_TRIM_INTERVAL seconds
+RECENT_HISTORY_LIMIT = 50
+HISTORY_TRIM_INTERVAL = 300
+
+# Tracking fields read by the carrier shipment list, dashboard and map views
+REALTIME_FIELDS = [
+    'shipment_id',
+    'current_status',
+    'last_updated',
+    'carrier_id',
+    'location',
+    'driver_info',
+    'notes'
+]
+
+def _isoformat_timestamps(value: Any) -> Any:
+    """
+    Firestore returns Timestamp fields as datetimes; convert them back to the ISO strings
+    the API, templates and socket payloads have always carried
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _isoformat_timestamps(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_isoformat_timestamps(item) for item in value]
+    return value
+
 class TFST_FirebaseService:
     """
     Service class for Firebase integration
@@ -24,12 +78,42 @@ class TFST_FirebaseService:
         self.db = None
         self.bucket = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        
+        # One listen stream per carrier, shared by all of its subscribers
+        self._listener_watches = {}
+        self._listener_callbacks = {}
+        self._listener_versions = {}  # carrier_id -> {doc_id: update_time last dispatched}
+        self._listeners_lock = threading.Lock()
+        
+        # Snapshot changes are processed here rather than on the SDK's listen thread;
+        # a single worker keeps them in order
+        self._dispatch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='firestore-dispatch')
+        
+        # Shared pool for overlapping independent Firestore/Storage calls
+        self._executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+        
+        # Short-lived read caches, invalidated on every write path
+        self._tracking_cache = TTLCache(maxsize=10000, ttl=TRACKING_CACHE_TTL)
+        self._documents_cache = TTLCache(maxsize=10000, ttl=DOCUMENTS_CACHE_TTL)
+        
+        # Shipments whose history has grown since the last trim
+        self._history_trim_pending = set()
+        self._history_trim_lock = threading.Lock()
     
     def _initialize_firebase(self):
         """Initialize Firebase Admin SDK if not already initialized"""
         if self._initialized:
             return
-            
+        
+        with self._init_lock:
+            # Another thread may have finished initializing while we waited
+            if self._initialized:
+                return
+            self._initialize_clients()
+    
+    def _initialize_clients(self):
+        """Create Firestore and Storage clients (caller holds the init lock)"""
         try:
             # Check if Firebase app is already initialized
             try:
@@ -59,10 +143,25 @@ class TFST_FirebaseService:
             # Initialize Firestore and Storage
             self.db = firestore.client()
             self.bucket = storage.bucket()
+            
+            # Collection references are reused by every call
+            self._tracking = self.db.collection('shipment_tracking')
+            self._documents = self.db.collection('documents')
+            
+            # URL prefixes used to map document URLs back to storage paths
+            self._download_url_prefix = f"https://firebasestorage.googleapis.com/v0/b/{self.bucket.name}/o/"
+            self._public_url_prefix = f"https://storage.googleapis.com/{self.bucket.name}/"
+            
+            # Warm up the gRPC channel so the first real request doesn't pay for the handshake
+            try:
+                list(self.db.collection('_warmup').limit(1).stream())
+            except Exception as e:
+                logger.warning("Firestore warmup read failed: %s", e)
+            
             self._initialized = True
             
         except Exception as e:
-            logger.error(f"Failed to initialize Firebase: {str(e)}")
+            logger.error("Failed to initialize Firebase: %s", e, exc_info=_debug_traceback())
             raise
     def update_shipment_tracking(self, shipment_id: str, tracking_data: Dict[str, Any]) -> bool:
         """
@@ -70,7 +169,8 @@ class TFST_FirebaseService:
         """
         try:
             self._initialize_firebase()
-            timestamp = datetime.now(timezone.utc).isoformat()
+            # Written server-side as a native Timestamp
+            timestamp = firestore.SERVER_TIMESTAMP
             
             # Prepare tracking update
             update_data = {
@@ -97,43 +197,141 @@ class TFST_FirebaseService:
             if 'notes' in tracking_data:
                 update_data['notes'] = tracking_data['notes']
             
-            # Update current tracking data
-            doc_ref = self.db.collection('shipment_tracking').document(shipment_id)
-            doc_ref.set(update_data, merge=True)
+            # The status history lives on the tracking document rather than a
+            # subcollection, so each update is one document write. Array elements
+            # can't hold server timestamps, so the entry carries a client timestamp.
+            history_time = datetime.now(timezone.utc)
+            history_location = None
+            if 'location' in update_data:
+                history_location = {**update_data['location'], 'timestamp': history_time}
             
-            # Add to status history
-            history_ref = self.db.collection('shipment_tracking').document(shipment_id).collection('status_history')
             history_data = {
                 'status': tracking_data.get('status'),
-                'timestamp': timestamp,
-                'location': update_data.get('location'),
+                'timestamp': history_time,
+                'location': history_location,
                 'notes': tracking_data.get('notes', ''),
                 'updated_by': 'carrier_portal'
             }
-            history_ref.add(history_data)
             
-            logger.info(f"Updated Firebase tracking for shipment {shipment_id}")
+            doc_ref = self._tracking.document(shipment_id)
+            cached = self._tracking_cache.get(shipment_id)
+            
+            if cached is None:
+                # Nothing known locally: update current tracking data and append to the
+                # history in one blind write
+                doc_ref.set({
+                    **update_data,
+                    'recent_history': firestore.ArrayUnion([history_data])
+                }, merge=True)
+                self._tracking_cache.invalidate(shipment_id)
+            else:
+                # Send only the fields that differ from the last-known document (GPS polling
+                # repeats the same values); a ping that changes nothing isn't written
+                cached_fields = self._tracked_fields(cached)
+                changed = [key for key, value in self._tracked_fields(update_data).items()
+                           if cached_fields.get(key) != value]
+                if not changed:
+                    logger.debug("Tracking for shipment %s unchanged; skipped write", shipment_id)
+                    return True
+                
+                changes = {key: update_data[key] for key in changed}
+                changes['last_updated'] = timestamp
+                changes['updated_by'] = update_data['updated_by']
+                changes['recent_history'] = firestore.ArrayUnion([history_data])
+                doc_ref.update(changes)
+                
+                # Keep the snapshot current so the next ping is compared against this one;
+                # server timestamps are approximated with the client time
+                written = _isoformat_timestamps({
+                    key: {**value, 'timestamp': history_time} if key == 'location' else value
+                    for key, value in changes.items() if key != 'recent_history'
+                })
+                written['last_updated'] = history_time.isoformat()
+                history = [*(cached.get('recent_history') or []), _isoformat_timestamps(history_data)]
+                self._tracking_cache.set(shipment_id, {
+                    **cached, **written, 'recent_history': history[-RECENT_HISTORY_LIMIT:]
+                })
+            
+            with self._history_trim_lock:
+                self._history_trim_pending.add(shipment_id)
+            
+            logger.info("Updated Firebase tracking for shipment %s", shipment_id)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to update Firebase tracking for {shipment_id}: {str(e)}")
+            logger.error("Failed to update Firebase tracking for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return False
     
+    def trim_recent_history(self) -> int:
+        """
+        Trim recent_history to RECENT_HISTORY_LIMIT entries on every tracking document
+        appended to since the last call. Returns the number of documents trimmed
+        """
+        with self._history_trim_lock:
+            pending = self._history_trim_pending
+            self._history_trim_pending = set()
+        
+        if not pending:
+            return 0
+        
+        self._initialize_firebase()
+        
+        @firestore.transactional
+        def trim(transaction, doc_ref):
+            snapshot = doc_ref.get(field_paths=['recent_history'], transaction=transaction)
+            history = (snapshot.to_dict() or {}).get('recent_history') if snapshot.exists else None
+            if not history or len(history) <= RECENT_HISTORY_LIMIT:
+                return False
+            transaction.update(doc_ref, {'recent_history': history[-RECENT_HISTORY_LIMIT:]})
+            return True
+        
+        trimmed = 0
+        for shipment_id in pending:
+            try:
+                if trim(self.db.transaction(), self._tracking.document(shipment_id)):
+                    trimmed += 1
+            except Exception as e:
+                logger.error("Failed to trim history for %s: %s", shipment_id, e, exc_info=_debug_traceback())
+        
+        return trimmed
+    
+    def run_history_trimmer(self, sleep):
+        """Call trim_recent_history every HISTORY_TRIM_INTERVAL; sleep is the server's sleep function"""
+        while True:
+            sleep(HISTORY_TRIM_INTERVAL)
+            self.trim_recent_history()
+    
+    def _tracked_fields(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Fields compared to decide which parts of a tracking update change anything"""
+        fields = {key: data[key] for key in DEDUP_FIELDS if key in data}
+        
+        location = fields.get('location')
+        if location:
+            fields['location'] = {'lat': location.get('lat'), 'lng': location.get('lng')}
+        
+        return fields
+    
     def get_shipment_tracking(self, shipment_id: str) -> Optional[Dict[str, Any]]:
         """
         Get current tracking data for a shipment
         """
+        cached = self._tracking_cache.get(shipment_id)
+        if cached is not None:
+            return cached
+        
         try:
             self._initialize_firebase()
-            doc_ref = self.db.collection('shipment_tracking').document(shipment_id)
+            doc_ref = self._tracking.document(shipment_id)
             doc = doc_ref.get()
             
             if doc.exists:
-                return doc.to_dict()
+                data = _isoformat_timestamps(doc.to_dict())
+                self._tracking_cache.set(shipment_id, data)
+                return data
             return None
             
         except Exception as e:
-            logger.error(f"Failed to get Firebase tracking for {shipment_id}: {str(e)}")
+            logger.error("Failed to get Firebase tracking for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return None
     
     def get_shipment_history(self, shipment_id: str, limit: int = 50) -> List[Dict[str, Any]]:
@@ -142,19 +340,41 @@ class TFST_FirebaseService:
         """
         try:
             self._initialize_firebase()
-            history_ref = self.db.collection('shipment_tracking').document(shipment_id).collection('status_history')
-            query = history_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+            doc_ref = self._tracking.document(shipment_id)
+            doc = doc_ref.get(field_paths=['recent_history'])
+            
+            recent_history = doc.to_dict().get('recent_history') if doc.exists else None
+            if recent_history is not None:
+                # Stored oldest first; return newest first
+                return _isoformat_timestamps(recent_history[::-1][:limit])
             
-            history = []
-            for doc in query.stream():
-                history.append(doc.to_dict())
+            # Shipments last updated before history moved onto the tracking document
+            history_ref = doc_ref.collection('status_history')
+            query = history_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
             
-            return history
+            return [_isoformat_timestamps(doc.to_dict()) for doc in query.get()]
             
         except Exception as e:
-            logger.error(f"Failed to get Firebase history for {shipment_id}: {str(e)}")
+            logger.error("Failed to get Firebase history for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return []
     
+    def get_shipment_bundle(self, shipment_id: str, history_limit: int = 50) -> Dict[str, Any]:
+        """
+        Get tracking data, status history and documents for a shipment
+        The three reads are issued concurrently over the shared client
+        """
+        self._initialize_firebase()
+        
+        tracking = self._executor.submit(self.get_shipment_tracking, shipment_id)
+        history = self._executor.submit(self.get_shipment_history, shipment_id, history_limit)
+        documents = self._executor.submit(self.get_shipment_documents, shipment_id)
+        
+        return {
+            'tracking': tracking.result(),
+            'history': history.result(),
+            'documents': documents.result()
+        }
+    
     def upload_document(self, file, shipment_id: str, document_type: str, carrier_id: str) -> Optional[str]:
         """
         Upload document to Firebase Storage
@@ -170,105 +390,184 @@ class TFST_FirebaseService:
             # Create storage path
             storage_path = f"documents/{carrier_id}/{shipment_id}/{document_type}/{unique_filename}"
             
-            # Upload to Firebase Storage
-            blob = self.bucket.blob(storage_path)
-            blob.upload_from_file(file, content_type=file.content_type)
+            # Known size lets small files go up as a single multipart request;
+            # larger files use resumable uploads in UPLOAD_CHUNK_SIZE chunks
+            file.seek(0, os.SEEK_END)
+            file_size = file.tell()
+            file.seek(0)
             
-            # Make the blob publicly accessible (or set appropriate permissions)
-            blob.make_public()
+            # Upload to Firebase Storage with a download token so the URL can
+            # be built locally instead of a make_public() round trip
+            download_token = str(uuid.uuid4())
+            blob = self.bucket.blob(storage_path, chunk_size=UPLOAD_CHUNK_SIZE)
+            blob.metadata = {'firebaseStorageDownloadTokens': download_token}
+            blob.upload_from_file(file, size=file_size, content_type=file.content_type)
             
             # Get download URL
-            download_url = blob.public_url
-            
-            # Update Firestore document record
-            doc_ref = self.db.collection('documents').document(shipment_id)
-            doc_data = doc_ref.get()
-            
-            if doc_data.exists:
-                current_data = doc_data.to_dict()
-            else:
-                current_data = {'shipment_id': shipment_id}
-            
-            # Add document URL to appropriate category
-            if document_type not in current_data:
-                current_data[document_type] = []
+            download_url = (
+                f"{self._download_url_prefix}{quote(storage_path, safe='')}"
+                f"?alt=media&token={download_token}"
+            )
             
-            current_data[document_type].append({
+            # Append to the document category in a single atomic write
+            entry = {
                 'url': download_url,
+                'storage_path': storage_path,
                 'filename': filename,
                 'uploaded_by': carrier_id,
                 'uploaded_at': datetime.now(timezone.utc).isoformat(),
-                'file_size': blob.size if hasattr(blob, 'size') else None,
+                'file_size': file_size,
                 'content_type': file.content_type
-            })
+            }
             
-            doc_ref.set(current_data, merge=True)
+            doc_ref = self._documents.document(shipment_id)
+            doc_ref.set({
+                'shipment_id': shipment_id,
+                document_type: firestore.ArrayUnion([entry])
+            }, merge=True)
+            self._documents_cache.invalidate(shipment_id)
             
-            logger.info(f"Uploaded document for shipment {shipment_id}: {filename}")
+            logger.info("Uploaded document for shipment %s: %s", shipment_id, filename)
             return download_url
             
         except Exception as e:
-            logger.error(f"Failed to upload document for {shipment_id}: {str(e)}")
+            logger.error("Failed to upload document for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return None
     
     def get_shipment_documents(self, shipment_id: str) -> Dict[str, List[Dict[str, Any]]]:
         """
         Get all documents for a shipment
         """
+        cached = self._documents_cache.get(shipment_id)
+        if cached is not None:
+            return cached
+        
         try:
             self._initialize_firebase()
-            doc_ref = self.db.collection('documents').document(shipment_id)
+            doc_ref = self._documents.document(shipment_id)
             doc = doc_ref.get()
             
             if doc.exists:
                 data = doc.to_dict()
                 # Remove shipment_id from the response
                 data.pop('shipment_id', None)
+                self._documents_cache.set(shipment_id, data)
                 return data
             
             return {}
             
         except Exception as e:
-            logger.error(f"Failed to get documents for {shipment_id}: {str(e)}")
+            logger.error("Failed to get documents for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return {}
     
-    def delete_document(self, shipment_id: str, document_type: str, document_url: str, carrier_id: str) -> bool:
+    def get_shipments_tracking_bulk(self, shipment_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Delete a document from Firebase Storage and Firestore
+        Get current tracking data for several shipments in one BatchGetDocuments call
+        Shipments without tracking data are omitted
+        """
+        return self._get_all_cached('shipment_tracking', shipment_ids, self._tracking_cache)
+    
+    def get_shipments_documents_bulk(self, shipment_ids: List[str]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
         """
+        Get documents for several shipments in one BatchGetDocuments call
+        Shipments without documents map to an empty dict
+        """
+        documents = self._get_all_cached('documents', shipment_ids, self._documents_cache)
+        for data in documents.values():
+            data.pop('shipment_id', None)
+        
+        return {shipment_id: documents.get(shipment_id, {}) for shipment_id in shipment_ids}
+    
+    def _get_all_cached(self, collection: str, shipment_ids: List[str], cache) -> Dict[str, Dict[str, Any]]:
+        """Serve cached documents and fetch the misses with a single get_all()"""
+        results = {}
+        missing = []
+        for shipment_id in dict.fromkeys(shipment_ids):
+            cached = cache.get(shipment_id)
+            if cached is not None:
+                results[shipment_id] = cached
+            else:
+                missing.append(shipment_id)
+        
+        if not missing:
+            return results
+        
         try:
             self._initialize_firebase()
-            # Extract storage path from URL
-            # This is a simplified approach - in production, you'd want to store the path
-            storage_path = document_url.split(f"{current_app.config['FIREBASE_PROJECT_ID']}.appspot.com/")[1]
+            collection_ref = self.db.collection(collection)
+            refs = [collection_ref.document(shipment_id) for shipment_id in missing]
             
-            # Delete from Storage
-            blob = self.bucket.blob(storage_path)
-            blob.delete()
+            for snap in self.db.get_all(refs):
+                if snap.exists:
+                    data = _isoformat_timestamps(snap.to_dict())
+                    cache.set(snap.id, data)
+                    results[snap.id] = data
             
-            # Update Firestore record
-            doc_ref = self.db.collection('documents').document(shipment_id)
-            doc_data = doc_ref.get()
+        except Exception as e:
+            logger.error("Failed to bulk read %s for %s shipments: %s", collection, len(missing), e, exc_info=_debug_traceback())
+        
+        return results
+    
+    def delete_document(self, shipment_id: str, document_type: str, document_url: str, carrier_id: str,
+                        entry: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Delete a document from Firebase Storage and Firestore
+        entry: the stored document entry, when the caller already has it
+        """
+        try:
+            self._initialize_firebase()
+            doc_ref = self._documents.document(shipment_id)
             
-            if doc_data.exists:
-                current_data = doc_data.to_dict()
-                
-                if document_type in current_data:
-                    # Remove the document from the list
-                    current_data[document_type] = [
-                        doc for doc in current_data[document_type] 
-                        if doc.get('url') != document_url
-                    ]
-                    
-                    doc_ref.set(current_data, merge=True)
+            # Find the stored entry: caller, or a read of just this category. The read cache
+            # may predate an upload made through another worker, so it isn't consulted
+            if entry is not None:
+                entries = [entry]
+            else:
+                field_path = firestore.FieldPath(document_type).to_api_repr()
+                doc_data = doc_ref.get(field_paths=[field_path])
+                entries = doc_data.to_dict().get(document_type, []) if doc_data.exists else []
+            
+            matching = [doc for doc in entries if doc.get('url') == document_url]
+            if not matching:
+                logger.warning("No %s document for shipment %s matches %s", document_type, shipment_id, document_url)
+                return False
+            
+            # Entries uploaded before storage_path was recorded need the URL parsed
+            storage_path = next(
+                (doc['storage_path'] for doc in matching if doc.get('storage_path')),
+                None
+            ) or self._storage_path_from_url(document_url)
+            
+            # Remove the entry first so a failure never leaves one pointing at a deleted
+            # file; if the file can't be deleted, put the entry back
+            doc_ref.update({document_type: firestore.ArrayRemove(matching)})
+            self._documents_cache.invalidate(shipment_id)
+            try:
+                self.bucket.blob(storage_path).delete()
+            except Exception:
+                doc_ref.update({document_type: firestore.ArrayUnion(matching)})
+                raise
             
-            logger.info(f"Deleted document for shipment {shipment_id}: {document_url}")
+            logger.info("Deleted document for shipment %s: %s", shipment_id, document_url)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to delete document for {shipment_id}: {str(e)}")
+            logger.error("Failed to delete document for %s: %s", shipment_id, e, exc_info=_debug_traceback())
             return False
     
+    def _storage_path_from_url(self, document_url: str) -> str:
+        """Map a stored document URL back to its storage path"""
+        if document_url.startswith(self._download_url_prefix):
+            # Firebase download URL: .../o/<encoded path>?alt=media&token=...
+            encoded_path = document_url[len(self._download_url_prefix):].split('?', 1)[0]
+            return unquote(encoded_path)
+        
+        if document_url.startswith(self._public_url_prefix):
+            # Legacy public URL from make_public()
+            return document_url[len(self._public_url_prefix):]
+        
+        raise ValueError(f"Unrecognized document URL: {document_url}")
+    
     def get_carrier_shipments_realtime(self, carrier_id: str) -> List[Dict[str, Any]]:
         """
         Get real-time tracking data for all shipments assigned to a carrier
@@ -276,18 +575,21 @@ class TFST_FirebaseService:
         try:
             self._initialize_firebase()
             # Query shipments by carrier_id
-            query = self.db.collection('shipment_tracking').where('carrier_id', '==', carrier_id)
+            query = self._tracking.where('carrier_id', '==', carrier_id)
+            query = query.select(REALTIME_FIELDS)
             
             shipments = []
-            for doc in query.stream():
-                shipment_data = doc.to_dict()
+            for doc in query.get():
+                shipment_data = _isoformat_timestamps(doc.to_dict())
+                # Projected documents lack history and audit fields, so they stay
+                # out of the full-document tracking cache
                 shipment_data['id'] = doc.id
                 shipments.append(shipment_data)
             
             return shipments
             
         except Exception as e:
-            logger.error(f"Failed to get carrier shipments for {carrier_id}: {str(e)}")
+            logger.error("Failed to get carrier shipments for %s: %s", carrier_id, e, exc_info=_debug_traceback())
             return []
     
     def batch_update_shipments(self, updates: List[Dict[str, Any]]) -> Dict[str, bool]:
@@ -298,11 +600,20 @@ class TFST_FirebaseService:
         
         try:
             self._initialize_firebase()
-            # Process in batches of 500 (Firestore limit)
+            
+            # Fields shared by every row are built once
+            template = {
+                'last_updated': firestore.SERVER_TIMESTAMP,
+                'updated_by': 'csv_batch_update'
+            }
+            
+            # Build batches of 500 (Firestore limit) before committing any of them
             batch_size = 500
+            batches = []
             for i in range(0, len(updates), batch_size):
                 batch = self.db.batch()
                 batch_updates = updates[i:i + batch_size]
+                batch_ids = []
                 
                 for update in batch_updates:
                     shipment_id = update.get('shipment_id')
@@ -310,16 +621,14 @@ class TFST_FirebaseService:
                         results[f"update_{i}"] = False
                         continue
                     
-                    doc_ref = self.db.collection('shipment_tracking').document(shipment_id)
+                    doc_ref = self._tracking.document(shipment_id)
                     
                     # Prepare the update data
-                    timestamp = datetime.now(timezone.utc).isoformat()
                     tracking_data = {
+                        **template,
                         'shipment_id': shipment_id,
                         'current_status': update.get('status'),
-                        'last_updated': timestamp,
-                        'carrier_id': update.get('carrier_id'),
-                        'updated_by': 'csv_batch_update'
+                        'carrier_id': update.get('carrier_id')
                     }
                     
                     if 'location' in update:
@@ -329,15 +638,34 @@ class TFST_FirebaseService:
                         tracking_data['driver_info'] = update['driver_info']
                     
                     batch.set(doc_ref, tracking_data, merge=True)
-                    results[shipment_id] = True
+                    batch_ids.append(shipment_id)
                 
-                # Commit the batch
-                batch.commit()
+                if batch_ids:
+                    batches.append((batch, batch_ids))
+            
+            # Commit batches concurrently over the shared client
+            if batches:
+                max_workers = min(BATCH_COMMIT_WORKERS, len(batches))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {executor.submit(batch.commit): batch_ids for batch, batch_ids in batches}
+                    
+                    for future in as_completed(futures):
+                        batch_ids = futures[future]
+                        try:
+                            future.result()
+                            committed = True
+                        except Exception as e:
+                            logger.error("Failed to commit batch of %s shipments: %s", len(batch_ids), e, exc_info=_debug_traceback())
+                            committed = False
+                        
+                        for shipment_id in batch_ids:
+                            results[shipment_id] = committed
+                            self._tracking_cache.invalidate(shipment_id)
                 
-            logger.info(f"Batch updated {len(updates)} shipments")
+            logger.info("Batch updated %s shipments", len(updates))
             
         except Exception as e:
-            logger.error(f"Failed to batch update shipments: {str(e)}")
+            logger.error("Failed to batch update shipments: %s", e, exc_info=_debug_traceback())
             # Mark all updates as failed
             for update in updates:
                 if 'shipment_id' in update:
@@ -345,26 +673,83 @@ class TFST_FirebaseService:
         
         return results
     
-    def create_realtime_listener(self, carrier_id: str, callback):
+    def create_realtime_listener(self, carrier_id: str, callback) -> bool:
         """
-        Create a real-time listener for carrier's shipments
-        This would be used in a WebSocket implementation
+        Subscribe a callback to real-time changes of a carrier's shipments
+        All subscribers for a carrier share a single Firestore listen stream
         """
         try:
             self._initialize_firebase()
-            query = self.db.collection('shipment_tracking').where('carrier_id', '==', carrier_id)
             
-            # Create listener
-            def on_snapshot(docs, changes, read_time):
-                for change in changes:
-                    if change.type.name == 'ADDED' or change.type.name == 'MODIFIED':
-                        callback(change.document.to_dict())
+            with self._listeners_lock:
+                if carrier_id not in self._listener_watches:
+                    query = self._tracking.where('carrier_id', '==', carrier_id)
+                    
+                    def on_snapshot(docs, changes, read_time):
+                        # Return to the listen stream straight away; materializing and
+                        # broadcasting the changes happens on the dispatch thread
+                        self._dispatch_executor.submit(self._dispatch_changes, carrier_id, changes)
+                    
+                    self._listener_watches[carrier_id] = query.on_snapshot(on_snapshot)
+                    logger.info("Created realtime listener for carrier %s", carrier_id)
+                
+                self._listener_callbacks.setdefault(carrier_id, []).append(callback)
             
-            query.on_snapshot(on_snapshot)
-            logger.info(f"Created realtime listener for carrier {carrier_id}")
+            return True
             
         except Exception as e:
-            logger.error(f"Failed to create realtime listener for {carrier_id}: {str(e)}")
+            logger.error("Failed to create realtime listener for %s: %s", carrier_id, e, exc_info=_debug_traceback())
+            return False
+    
+    def remove_realtime_listener(self, carrier_id: str, callback):
+        """
+        Unsubscribe a callback; the listen stream closes with the last subscriber
+        """
+        with self._listeners_lock:
+            callbacks = self._listener_callbacks.get(carrier_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if callbacks:
+                return
+            
+            self._listener_callbacks.pop(carrier_id, None)
+            self._listener_versions.pop(carrier_id, None)
+            watch = self._listener_watches.pop(carrier_id, None)
+        
+        if watch:
+            watch.unsubscribe()
+            logger.info("Closed realtime listener for carrier %s", carrier_id)
+    
+    def _dispatch_changes(self, carrier_id: str, changes):
+        """Fan out snapshot changes to every subscriber for the carrier"""
+        with self._listeners_lock:
+            if carrier_id not in self._listener_callbacks:
+                return  # Snapshot raced with the last unsubscribe
+            callbacks = list(self._listener_callbacks[carrier_id])
+            versions = self._listener_versions.setdefault(carrier_id, {})
+        
+        for change in changes:
+            doc_id = change.document.id
+            self._tracking_cache.invalidate(doc_id)
+            
+            # Removed documents are never dispatched, so don't materialize them
+            if change.type.name == 'REMOVED':
+                versions.pop(doc_id, None)
+                continue
+            
+            # Resyncs re-deliver documents that haven't changed since we last saw them
+            update_time = change.document.update_time
+            if change.type.name == 'MODIFIED' and update_time is not None and versions.get(doc_id) == update_time:
+                continue
+            versions[doc_id] = update_time
+            
+            data = _isoformat_timestamps(change.document.to_dict() or {})
+            data['document_id'] = doc_id
+            for callback in callbacks:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error("Realtime callback failed for carrier %s: %s", carrier_id, e, exc_info=_debug_traceback())
 
 # Singleton instance
 firebase_service = TFST_FirebaseService()
\ No newline at end of file
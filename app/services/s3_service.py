@@ -3,22 +3,146 @@ TFST Carrier Portal - S3 CSV Processing Service
 Process carrier CSV uploads from Amazon S3 (without database dependencies)
 """
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import pandas as pd
+import functools
 import io
 import logging
+import threading
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
 from flask import current_app
+from werkzeug.utils import secure_filename
+from app.utils.cache import TTLCache
 import uuid
+from collections import OrderedDict, defaultdict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-# In-memory storage for upload logs
-_upload_logs = {}
+# Parse with Arrow's multithreaded reader when pyarrow is installed
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+# Text columns are never type-inferred: IDs keep leading zeros and timestamps
+# are validated and passed through verbatim. Status is dictionary-encoded,
+# storing one string per distinct value.
+_TEXT_COLUMNS = ('shipment_id', 'timestamp', 'driver_name', 'truck_number', 'notes')
+
+_READ_CSV_KWARGS = {
+    'encoding': 'utf-8',
+    'engine': 'c',
+    'dtype': {**{column: str for column in _TEXT_COLUMNS}, 'status': 'category'}
+}
+
+# pandas' pyarrow engine applies dtypes only after Arrow has inferred them,
+# so the column types are pinned on Arrow's reader directly
+_ARROW_CONVERT_OPTIONS = pa_csv.ConvertOptions(
+    column_types={
+        **{column: pa.string() for column in _TEXT_COLUMNS},
+        'status': pa.dictionary(pa.int32(), pa.string())
+    },
+    strings_can_be_null=True
+) if pa_csv is not None else None
+
+# Concurrent CSV downloads/parses when processing a carrier's backlog
+CSV_PROCESSING_WORKERS = 16
+
+# Files below this size are prefetched together by process_carrier_batch
+SMALL_CSV_BYTES = 100 * 1024
+BATCH_PREFETCH_WORKERS = 32
+
+# Connection pool shared by every S3 call; sized with the transfer configs below so
+# CSV_PROCESSING_WORKERS concurrent multipart downloads never wait on a socket
+S3_MAX_POOL_CONNECTIONS = 32
+
+_S3_CLIENT_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
+
+@functools.lru_cache(maxsize=4)
+def _get_s3_client(region: str, access_key: str, secret_key: str):
+    """Create (once per credential set) a shared, thread-safe S3 client"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region,
+        config=_S3_CLIENT_CONFIG
+    )
+
+# Objects at or above this size move as concurrent multipart transfers
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True
+)
+
+# Downloads inside process_all_pending's workers split the pool between them
+_POOLED_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=max(1, S3_MAX_POOL_CONNECTIONS // CSV_PROCESSING_WORKERS),
+    use_threads=True
+)
+
+# Files at or above this size are parsed in row chunks to bound peak memory
+CHUNKED_PARSE_BYTES = 64 * 1024 * 1024
+CSV_CHUNK_ROWS = 100_000
+
+# Columns every carrier CSV must provide
+_REQUIRED_COLUMNS = ('shipment_id', 'status', 'timestamp')
+
+# Shipment statuses accepted from carrier CSVs
+_VALID_STATUSES = frozenset({
+    'Dispatched',
+    'At pickup site',
+    'Pickup Complete',
+    'In Transit',
+    'Delayed',
+    'Arrived at site',
+    'Delivered',
+    'Unloading complete'
+})
+
+# Last parse of recently processed small CSVs: s3_key -> (etag, DataFrame).
+# Only objects up to PARSED_CSV_CACHE_MAX_BYTES are kept, bounding the cache
+# to a few MB of frames
+PARSED_CSV_CACHE_MAX_BYTES = 256 * 1024
+_parsed_csv_cache = TTLCache(maxsize=32, ttl=300)
+
+# In-memory storage for upload logs, oldest evicted first once full
+_MAX_LOGS = 50_000
+_upload_logs = OrderedDict()
+
+# Secondary indexes over _upload_logs
+_logs_by_carrier = defaultdict(deque)  # carrier_id -> logs in creation order
+# carrier_id -> s3_keys processed successfully; only keys are kept, so evicted logs
+# aren't held alive and processed files stay marked after their log is gone
+_completed_keys_by_carrier = defaultdict(set)
+
+# Logs are created and completed from CSV worker threads
+_logs_lock = threading.Lock()
 
 class S3UploadLog:
     """In-memory replacement for TFST_S3UploadLog database model"""
     
+    __slots__ = (
+        'id', 'carrier_id', 'filename', 's3_key', 'processed_at', 'status',
+        'error_details', 'records_processed', 'records_failed', 'created_at', 'etag'
+    )
+    
     def __init__(self, carrier_id, filename, s3_key):
         self.id = str(uuid.uuid4())
         self.carrier_id = carrier_id
@@ -30,9 +154,21 @@ class S3UploadLog:
         self.records_processed = 0
         self.records_failed = 0
         self.created_at = datetime.utcnow()
+        self.etag = None
         
         # Store in memory
-        _upload_logs[self.id] = self
+        with _logs_lock:
+            _upload_logs[self.id] = self
+            _logs_by_carrier[carrier_id].append(self)
+            
+            # Both structures are appended under the lock, so the globally oldest
+            # log is also its carrier's oldest
+            while len(_upload_logs) > _MAX_LOGS:
+                _, evicted = _upload_logs.popitem(last=False)
+                carrier_logs = _logs_by_carrier[evicted.carrier_id]
+                carrier_logs.popleft()
+                if not carrier_logs:
+                    del _logs_by_carrier[evicted.carrier_id]
     
     def mark_processing(self):
         """Mark upload as currently being processed"""
@@ -45,6 +181,8 @@ class S3UploadLog:
         self.records_processed = processed_count
         self.records_failed = failed_count
         self.processed_at = datetime.utcnow()
+        with _logs_lock:
+            _completed_keys_by_carrier[self.carrier_id].add(self.s3_key)
     
     def mark_error(self, error_message):
         """Mark upload as failed with error details"""
@@ -74,21 +212,27 @@ class TFST_S3Service:
     
     def __init__(self):
         self.s3_client = None
-        self._initialized = False
+        self._app_id = None
+        self._bucket = None
+        self._region = None
     
     def _initialize_s3(self):
-        """Initialize S3 client if not already initialized"""
-        if self._initialized:
+        """Initialize S3 client if not already initialized for the current app"""
+        app = current_app._get_current_object()
+        if self._app_id == id(app):
             return
             
         try:
-            self.s3_client = boto3.client(
-                's3',
-                aws_access_key_id=current_app.config['AWS_ACCESS_KEY_ID'],
-                aws_secret_access_key=current_app.config['AWS_SECRET_ACCESS_KEY'],
-                region_name=current_app.config['AWS_S3_REGION']
+            # Resolve config once; later calls read the cached attributes
+            cfg = app.config
+            self.s3_client = _get_s3_client(
+                cfg['AWS_S3_REGION'],
+                cfg['AWS_ACCESS_KEY_ID'],
+                cfg['AWS_SECRET_ACCESS_KEY']
             )
-            self._initialized = True
+            self._bucket = cfg['AWS_S3_BUCKET']
+            self._region = cfg['AWS_S3_REGION']
+            self._app_id = id(app)
             logger.info("S3 client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize S3 client: {str(e)}")
@@ -101,7 +245,7 @@ class TFST_S3Service:
         self._initialize_s3()
         
         try:
-            bucket_name = current_app.config['AWS_S3_BUCKET']
+            bucket_name = self._bucket
             
             # Create prefix for carrier files
             if prefix:
@@ -109,21 +253,23 @@ class TFST_S3Service:
             else:
                 file_prefix = f"carriers/{carrier_id}/"
             
-            response = self.s3_client.list_objects_v2(
-                Bucket=bucket_name,
-                Prefix=file_prefix
-            )
+            # Completed keys for this carrier, looked up once for the whole listing
+            with _logs_lock:
+                processed_keys = frozenset(_completed_keys_by_carrier.get(carrier_id, ()))
+            
+            # Walk every page; a single list_objects_v2 call stops at 1000 keys
+            paginator = self.s3_client.get_paginator('list_objects_v2')
             
             files = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=file_prefix):
+                for obj in page.get('Contents', []):
                     if obj['Key'].endswith('.csv'):
                         files.append({
                             'key': obj['Key'],
                             'filename': obj['Key'].split('/')[-1],
                             'size': obj['Size'],
                             'last_modified': obj['LastModified'].isoformat(),
-                            'processed': self._check_if_processed(carrier_id, obj['Key'])
+                            'processed': obj['Key'] in processed_keys
                         })
             
             return files
@@ -132,9 +278,12 @@ class TFST_S3Service:
             logger.error(f"Error listing CSV files for carrier {carrier_id}: {str(e)}")
             return []
     
-    def process_csv_file(self, carrier_id: str, s3_key: str) -> Dict[str, Any]:
+    def process_csv_file(self, carrier_id: str, s3_key: str, size: Optional[int] = None, body=None,
+                         transfer_config: TransferConfig = _TRANSFER_CONFIG) -> Dict[str, Any]:
         """
         Process a CSV file from S3 and update shipment statuses
+        Pass the object size when known so large files use a multipart download,
+        or an already fetched body to skip the download
         """
         self._initialize_s3()
         
@@ -149,52 +298,45 @@ class TFST_S3Service:
         upload_log.mark_processing()
         
         try:
-            # Download CSV from S3
-            csv_content = self._download_csv_from_s3(s3_key)
-            
-            # Parse CSV
-            df = pd.read_csv(io.StringIO(csv_content))
-            
-            # Validate CSV format
-            validation_result = self._validate_csv_format(df)
-            if not validation_result['valid']:
-                upload_log.mark_error(f"CSV validation failed: {validation_result['error']}")
-                return {
-                    'success': False,
-                    'error': validation_result['error'],
-                    'upload_log_id': upload_log.id
-                }
-            
-            # Process each row
+            if body is not None:
+                csv_frames = self._read_csv_frames(body, size)
+            elif size is not None and MULTIPART_THRESHOLD <= size < CHUNKED_PARSE_BYTES:
+                # Large objects are fetched as parallel ranged parts into memory
+                csv_body = self._download_fileobj(self._bucket, s3_key, transfer_config)
+                csv_frames = self._read_csv_frames(csv_body, size)
+            else:
+                # Single GET, sized from its response when the caller didn't know the size;
+                # skipped when the object is unchanged since its last parse
+                csv_frames = self._load_csv_frames(s3_key, upload_log)
+            
+            # Validate, build and send shipment updates column-wise, one frame at a time,
+            # so a chunked file never holds more than one chunk's updates
+            # One fallback time for every invalid timestamp in the file
+            now_iso = datetime.now(timezone.utc).isoformat()
             processed_count = 0
             failed_count = 0
             errors = []
-            
-            salesforce_updates = []
-            firebase_updates = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Parse row data
-                    shipment_data = self._parse_csv_row(row, carrier_id)
-                    
-                    if shipment_data:
-                        salesforce_updates.append(shipment_data)
-                        firebase_updates.append(shipment_data)
-                        processed_count += 1
-                    else:
-                        failed_count += 1
-                        errors.append(f"Row {index + 1}: Invalid data format")
-                        
-                except Exception as e:
-                    failed_count += 1
-                    errors.append(f"Row {index + 1}: {str(e)}")
-                    logger.error(f"Error processing row {index + 1}: {str(e)}")
-            
-            # In a real implementation, we would update Salesforce and Firebase here
-            # For now, we'll just simulate success
-            sf_results = {update.get('shipment_id', f"unknown_{i}"): True for i, update in enumerate(salesforce_updates)}
-            fb_results = {update.get('shipment_id', f"unknown_{i}"): True for i, update in enumerate(firebase_updates)}
+            for df in csv_frames:
+                validation_result = self._validate_csv_format(df)
+                if not validation_result['valid']:
+                    upload_log.mark_error(f"CSV validation failed: {validation_result['error']}")
+                    return {
+                        'success': False,
+                        'error': validation_result['error'],
+                        'processed_count': processed_count,  # sent from earlier chunks
+                        'upload_log_id': upload_log.id
+                    }
+                
+                # Set aside unusable rows in one pass instead of failing row by row
+                valid_rows, row_failures, row_errors = self._partition_rows(df)
+                failed_count += row_failures
+                errors.extend(row_errors[:10 - len(errors)])
+                
+                shipment_updates = self._build_shipment_updates(valid_rows, carrier_id, now_iso)
+                processed_count += self._send_shipment_updates(shipment_updates)
+            
+            sf_results = {'count': processed_count}
+            fb_results = {'count': processed_count}
             
             # Update log with results
             upload_log.mark_completed(processed_count, failed_count)
@@ -209,7 +351,7 @@ class TFST_S3Service:
             }
             
             if errors:
-                result['errors'] = errors[:10]  # Limit errors shown
+                result['errors'] = errors  # Limited to the first 10
             
             logger.info(f"Processed CSV file {filename}: {processed_count} success, {failed_count} failed")
             return result
@@ -225,35 +367,132 @@ class TFST_S3Service:
                 'upload_log_id': upload_log.id
             }
     
-    def _download_csv_from_s3(self, s3_key: str) -> str:
-        """Download CSV content from S3"""
+    def _send_shipment_updates(self, shipment_updates: List[Dict[str, Any]]) -> int:
+        """
+        Send one frame's shipment updates, returning how many were applied
+        In a real implementation, we would update Salesforce and Firebase here,
+        both from the same update list. For now, we'll just simulate success
+        """
+        return len(shipment_updates)
+    
+    def process_all_pending(self, carrier_id: str) -> List[Dict[str, Any]]:
+        """
+        Process every unprocessed CSV file for a carrier
+        Files are downloaded and parsed concurrently; S3 I/O releases the GIL
+        """
+        pending_files = [f for f in self.list_carrier_csv_files(carrier_id) if not f['processed']]
+        if not pending_files:
+            return []
+        
+        app = current_app._get_current_object()
+        
+        def process(file_info):
+            # Worker threads need their own app context for config access
+            with app.app_context():
+                return self.process_csv_file(carrier_id, file_info['key'], file_info['size'],
+                                             transfer_config=_POOLED_TRANSFER_CONFIG)
+        
+        with ThreadPoolExecutor(max_workers=min(CSV_PROCESSING_WORKERS, len(pending_files))) as executor:
+            results = list(executor.map(process, pending_files))
+        
+        logger.info(f"Processed {len(results)} pending CSV files for carrier {carrier_id}")
+        return results
+    
+    def process_carrier_batch(self, carrier_id: str) -> List[Dict[str, Any]]:
+        """
+        Process all pending CSV files for a carrier in one pass
+        Small files are fetched with overlapping GETs up front, so per-request
+        latency is paid once per batch rather than once per file
+        """
+        self._initialize_s3()
+        
+        pending_files = [f for f in self.list_carrier_csv_files(carrier_id) if not f['processed']]
+        if not pending_files:
+            return []
+        
+        small_keys = [f['key'] for f in pending_files if f['size'] < SMALL_CSV_BYTES]
+        prefetched = {}
+        if small_keys:
+            with ThreadPoolExecutor(max_workers=min(BATCH_PREFETCH_WORKERS, len(small_keys))) as executor:
+                prefetched = dict(zip(small_keys, executor.map(self._prefetch_csv, small_keys)))
+        
+        # Files that failed to prefetch fall back to a regular download
+        results = [
+            self.process_csv_file(carrier_id, f['key'], f['size'], prefetched.get(f['key']))
+            for f in pending_files
+        ]
+        
+        logger.info(f"Batch processed {len(results)} CSV files for carrier {carrier_id} ({len(small_keys)} prefetched)")
+        return results
+    
+    def _prefetch_csv(self, s3_key: str) -> Optional[io.BytesIO]:
+        """Read a small CSV object fully into memory, None on failure"""
         try:
-            bucket_name = current_app.config['AWS_S3_BUCKET']
-            
-            response = self.s3_client.get_object(
-                Bucket=bucket_name,
-                Key=s3_key
-            )
-            
-            return response['Body'].read().decode('utf-8')
-            
+            response = self.s3_client.get_object(Bucket=self._bucket, Key=s3_key)
+            return io.BytesIO(response['Body'].read())
         except Exception as e:
+            logger.warning(f"Failed to prefetch CSV {s3_key}: {str(e)}")
+            return None
+    
+    def _load_csv_frames(self, s3_key: str, upload_log: S3UploadLog) -> Iterable[pd.DataFrame]:
+        """
+        Download and parse a CSV, reusing the cached parse if its ETag still matches
+        Oversize objects are parsed in row chunks as the body streams in
+        """
+        cached = _parsed_csv_cache.get(s3_key)
+        request = {'Bucket': self._bucket, 'Key': s3_key}
+        if cached is not None:
+            request['IfNoneMatch'] = cached[0]
+        
+        try:
+            response = self.s3_client.get_object(**request)
+        except ClientError as e:
+            if cached is not None and e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                upload_log.etag = cached[0]
+                return [cached[1]]
             logger.error(f"Failed to download CSV from S3: {str(e)}")
             raise
+        
+        upload_log.etag = response['ETag']
+        size = response.get('ContentLength')
+        if size is not None and size >= CHUNKED_PARSE_BYTES:
+            _parsed_csv_cache.invalidate(s3_key)
+            return self._read_csv_frames(response['Body'], size)
+        
+        df = next(self._read_csv_frames(response['Body']))
+        if size is not None and size <= PARSED_CSV_CACHE_MAX_BYTES:
+            _parsed_csv_cache.set(s3_key, (response['ETag'], df))
+        else:
+            # A previous, smaller version may still be cached
+            _parsed_csv_cache.invalidate(s3_key)
+        return [df]
+    
+    def _download_fileobj(self, bucket_name: str, s3_key: str,
+                          transfer_config: TransferConfig = _TRANSFER_CONFIG) -> io.BytesIO:
+        """Download an object with concurrent multipart GETs"""
+        buffer = io.BytesIO()
+        self.s3_client.download_fileobj(bucket_name, s3_key, buffer, Config=transfer_config)
+        buffer.seek(0)
+        return buffer
+    
+    def _read_csv_frames(self, csv_body, size: Optional[int] = None):
+        """Yield the CSV as one DataFrame, or as row chunks for oversize files"""
+        if size is None or size < CHUNKED_PARSE_BYTES:
+            # Parse straight from the byte stream, no intermediate str copy
+            if pa_csv is not None:
+                yield pa_csv.read_csv(csv_body, convert_options=_ARROW_CONVERT_OPTIONS).to_pandas()
+            else:
+                yield pd.read_csv(csv_body, **_READ_CSV_KWARGS)
+            return
+        
+        # Arrow cannot read in row chunks, so oversize files use the C parser
+        with pd.read_csv(csv_body, chunksize=CSV_CHUNK_ROWS, **_READ_CSV_KWARGS) as reader:
+            yield from reader
     
     def _validate_csv_format(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Validate CSV format and required columns"""
-        required_columns = [
-            'shipment_id',
-            'status',
-            'timestamp'
-        ]
-        
         # Check for required columns
-        missing_columns = []
-        for col in required_columns:
-            if col not in df.columns:
-                missing_columns.append(col)
+        missing_columns = [col for col in _REQUIRED_COLUMNS if col not in df.columns]
         
         if missing_columns:
             return {
@@ -268,83 +507,105 @@ class TFST_S3Service:
                 'error': "CSV file is empty"
             }
         
-        # Check for valid statuses
-        valid_statuses = [
-            'Dispatched',
-            'At pickup site',
-            'Pickup Complete',
-            'In Transit',
-            'Delayed',
-            'Arrived at site',
-            'Delivered',
-            'Unloading complete'
-        ]
+        # Check for valid statuses; categoricals only need their categories checked
+        statuses = df['status']
+        if isinstance(statuses.dtype, pd.CategoricalDtype):
+            invalid_statuses = set(statuses.cat.categories) - _VALID_STATUSES
+            # Missing values are not categories; report them as the object path does
+            if statuses.hasnans:
+                invalid_statuses.add('nan')
+        else:
+            invalid_statuses = set(statuses.unique()) - _VALID_STATUSES
         
-        invalid_statuses = df[~df['status'].isin(valid_statuses)]['status'].unique()
-        if len(invalid_statuses) > 0:
+        if invalid_statuses:
             return {
                 'valid': False,
-                'error': f"Invalid status values found: {', '.join(invalid_statuses)}"
+                'error': f"Invalid status values found: {', '.join(sorted(map(str, invalid_statuses)))}"
             }
         
         return {'valid': True}
     
-    def _parse_csv_row(self, row: pd.Series, carrier_id: str) -> Optional[Dict[str, Any]]:
-        """Parse a CSV row into shipment update data"""
-        try:
-            shipment_data = {
-                'shipment_id': str(row['shipment_id']).strip(),
-                'status': str(row['status']).strip(),
-                'timestamp': str(row['timestamp']).strip(),
-                'carrier_id': carrier_id
-            }
-            
-            # Parse location if provided
-            if pd.notna(row.get('location_lat')) and pd.notna(row.get('location_lng')):
-                try:
-                    shipment_data['location'] = {
-                        'lat': float(row['location_lat']),
-                        'lng': float(row['location_lng'])
-                    }
-                except (ValueError, TypeError):
-                    pass  # Skip invalid coordinates
-            
-            # Parse driver info if provided
+    def _partition_rows(self, df: pd.DataFrame, max_errors: int = 10):
+        """Split off rows without a shipment ID; returns (valid rows, failed count, errors)"""
+        shipment_ids = df['shipment_id'].str.strip()
+        valid_mask = shipment_ids.notna() & (shipment_ids != '')
+        if valid_mask.all():
+            return df, 0, []
+        
+        # Index counts data rows across chunks; +2 for the header and 1-based lines
+        invalid_rows = df.index[~valid_mask]
+        errors = [f"Row {row + 2}: missing shipment_id" for row in invalid_rows[:max_errors]]
+        return df[valid_mask], len(invalid_rows), errors
+    
+    def _build_shipment_updates(self, df: pd.DataFrame, carrier_id: str,
+                                now_iso: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Parse all CSV rows into shipment update data using vectorized column operations"""
+        # Keep valid ISO timestamps as given; replace invalid ones with the current time.
+        # The ISO8601 parser accepts a trailing 'Z' itself, so no rewrite pass is needed
+        timestamps = df['timestamp'].str.strip()
+        parsed = pd.to_datetime(timestamps, format='ISO8601', errors='coerce', utc=True)
+        invalid_timestamps = parsed.isna()
+        if invalid_timestamps.any():
+            timestamps = timestamps.mask(invalid_timestamps, now_iso or datetime.now(timezone.utc).isoformat())
+        
+        # Validated categories are already clean; rows share each category's str
+        statuses = df['status']
+        if isinstance(statuses.dtype, pd.CategoricalDtype):
+            statuses = statuses.astype(object)
+        else:
+            statuses = statuses.astype(str).str.strip()
+        
+        updates = pd.DataFrame({
+            'shipment_id': df['shipment_id'].str.strip(),
+            'status': statuses,
+            'timestamp': timestamps,
+            'carrier_id': carrier_id
+        }).to_dict(orient='records')
+        
+        # Parse location where both coordinates are numeric
+        if 'location_lat' in df.columns and 'location_lng' in df.columns:
+            lat = pd.to_numeric(df['location_lat'], errors='coerce')
+            lng = pd.to_numeric(df['location_lng'], errors='coerce')
+            has_location = (lat.notna() & lng.notna()).tolist()
+            
+            for update, valid, row_lat, row_lng in zip(updates, has_location, lat.tolist(), lng.tolist()):
+                if valid:
+                    update['location'] = {'lat': row_lat, 'lng': row_lng}
+        
+        # Parse driver info and notes if provided
+        driver_names = self._optional_text_column(df, 'driver_name')
+        truck_numbers = self._optional_text_column(df, 'truck_number')
+        notes = self._optional_text_column(df, 'notes')
+        
+        for update, driver_name, truck_number, note in zip(updates, driver_names, truck_numbers, notes):
             driver_info = {}
-            if pd.notna(row.get('driver_name')):
-                driver_info['name'] = str(row['driver_name']).strip()
-            if pd.notna(row.get('truck_number')):
-                driver_info['truck_number'] = str(row['truck_number']).strip()
+            if driver_name is not None:
+                driver_info['name'] = driver_name
+            if truck_number is not None:
+                driver_info['truck_number'] = truck_number
             
             if driver_info:
-                shipment_data['driver_info'] = driver_info
-            
-            # Add notes if provided
-            if pd.notna(row.get('notes')):
-                shipment_data['notes'] = str(row['notes']).strip()
+                update['driver_info'] = driver_info
             
-            # Validate timestamp format
-            try:
-                datetime.fromisoformat(shipment_data['timestamp'].replace('Z', '+00:00'))
-            except:
-                # If timestamp is invalid, use current time
-                shipment_data['timestamp'] = datetime.now(timezone.utc).isoformat()
-            
-            return shipment_data
-            
-        except Exception as e:
-            logger.error(f"Error parsing CSV row: {str(e)}")
-            return None
+            if note is not None:
+                update['notes'] = note
+        
+        return updates
+    
+    def _optional_text_column(self, df: pd.DataFrame, column: str) -> List[Optional[str]]:
+        """Stripped string values of an optional column, None where missing"""
+        if column not in df.columns:
+            return [None] * len(df)
+        
+        # Read as text, so only stripping is left to do
+        values = df[column]
+        return values.str.strip().where(values.notna(), None).tolist()
     
     def _check_if_processed(self, carrier_id: str, s3_key: str) -> bool:
         """Check if a file has already been processed"""
         try:
-            # Look in our in-memory storage
-            for log_id, log in _upload_logs.items():
-                if log.carrier_id == carrier_id and log.s3_key == s3_key and log.status == 'completed':
-                    return True
-            
-            return False
+            with _logs_lock:
+                return s3_key in _completed_keys_by_carrier.get(carrier_id, ())
             
         except Exception as e:
             logger.error(f"Error checking if file processed: {str(e)}")
@@ -353,12 +614,13 @@ class TFST_S3Service:
     def get_processing_history(self, carrier_id: str, limit: int = 50) -> List[Dict[str, Any]]:
         """Get CSV processing history for a carrier"""
         try:
-            # Filter logs for this carrier and sort by created_at
-            carrier_logs = [log for log_id, log in _upload_logs.items() if log.carrier_id == carrier_id]
-            carrier_logs.sort(key=lambda x: x.created_at, reverse=True)
-            
-            # Limit results
-            limited_logs = carrier_logs[:limit]
+            # Carrier logs are kept in creation order; newest first. Taken under the
+            # lock, since workers may append or evict while we iterate
+            with _logs_lock:
+                carrier_logs = _logs_by_carrier.get(carrier_id, ())
+                
+                # Limit results
+                limited_logs = list(islice(reversed(carrier_logs), limit))
             
             return [log.to_dict() for log in limited_logs]
             
@@ -395,7 +657,14 @@ class TFST_S3Service:
         self._initialize_s3()
         
         try:
-            bucket_name = current_app.config['AWS_S3_BUCKET']
+            bucket_name = self._bucket
+            filename = secure_filename(filename)
+            
+            # Uploads are accepted by content, but listing only picks up .csv keys
+            if filename.lower().endswith('.csv'):
+                filename = f"{filename[:-4]}.csv"
+            else:
+                filename = f"{filename or 'upload'}.csv"
             
             # Generate S3 key
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -406,7 +675,8 @@ class TFST_S3Service:
                 file,
                 bucket_name,
                 s3_key,
-                ExtraArgs={'ContentType': 'text/csv'}
+                ExtraArgs={'ContentType': 'text/csv'},
+                Config=_TRANSFER_CONFIG
             )
             
             logger.info(f"Uploaded CSV file to S3: {s3_key}")
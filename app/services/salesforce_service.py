@@ -2,22 +2,245 @@
 TFST Carrier Portal - Salesforce Integration Service
 Real-time API connection using system admin credentials
 """
+import atexit
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+import types
+import redis
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-from simple_salesforce import Salesforce
-from flask import current_app, session
+from flask import current_app, has_app_context, session
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
+from urllib.parse import quote, urlencode
+from app.utils.cache import SharedTTLCache
+from concurrent.futures import ThreadPoolExecutor
+
+# Decode large REST payloads with orjson when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+class SalesforceServiceError(Exception):
+    """The service could not complete a Salesforce request (not connected, record rejected)"""
+
+# Failures a Salesforce call is expected to raise; anything else is a bug and propagates.
+# simple_salesforce's SalesforceError is added when the library is first imported
+SALESFORCE_ERRORS = (SalesforceServiceError, requests.RequestException, ValueError)
+
+# simple_salesforce pulls in a large dependency tree, so it is imported on first connect
+_sf_lib = None
+_sf_lib_lock = threading.Lock()
+
+def _simple_salesforce() -> types.SimpleNamespace:
+    """simple_salesforce's client and exception classes, imported on first use"""
+    global _sf_lib, SALESFORCE_ERRORS
+    if _sf_lib is None:
+        with _sf_lib_lock:
+            if _sf_lib is None:
+                from simple_salesforce import Salesforce
+                from simple_salesforce.exceptions import SalesforceError, SalesforceExpiredSession
+                
+                # The library can only raise its errors once it has been imported
+                SALESFORCE_ERRORS = SALESFORCE_ERRORS + (SalesforceError,)
+                _sf_lib = types.SimpleNamespace(
+                    Salesforce=Salesforce,
+                    SalesforceExpiredSession=SalesforceExpiredSession
+                )
+    return _sf_lib
+
+# Composite Batch accepts at most this many subrequests per call
+COMPOSITE_BATCH_LIMIT = 25
+
+# Authorization request parameters that never change
+_OAUTH_STATIC_PARAMS = {
+    'response_type': 'code',
+    'scope': 'api id profile email address phone offline_access'
+}
+
+# Stamped on every tracking record this portal creates
+TRACKING_EVENT_SOURCE = 'Carrier Portal'
+
+# sObject Collections accept at most this many records per call
+SOBJECT_COLLECTION_LIMIT = 200
+
+# Shipment list projections; callers that render few columns select only those.
+# TFST_Carrier__c is the filter value, so list queries never need to return it
+SHIPMENT_FIELDS = (
+    'Id', 'Name', 'TFST_Shipment_Type__c', 'TFST_Status__c',
+    'TFST_Current_Coordinates__c', 'TFST_Driver_Name__c', 'TFST_Driver_Phone__c',
+    'TFST_Predicted_Delivery_Date__c', 'TFST_Project_Reference__c',
+    'Required_Delivery_Date__c', 'TFST_Total_Weight__c', 'TFST_Total_Volume__c',
+    'TFST_Service_Level__c', 'TFST_Current_Speed__c', 'TFST_GPS_Enabled__c'
+)
+SHIPMENT_KPI_FIELDS = ('Id', 'Name', 'TFST_Status__c', 'Required_Delivery_Date__c')
+SHIPMENT_SUMMARY_FIELDS = SHIPMENT_KPI_FIELDS + ('TFST_Project_Reference__c', 'TFST_Total_Weight__c')
+SHIPMENT_LIST_FIELDS = SHIPMENT_SUMMARY_FIELDS + ('TFST_Service_Level__c', 'TFST_Service_Order_Number__c')
+SHIPMENT_DETAIL_FIELDS = SHIPMENT_FIELDS + (
+    'TFST_Carrier__c', 'Special_Instructions__c', 'TFST_Transportation_Request__c',
+    'TFST_Quote_Request__c', 'TFST_Service_Order_Number__c'
+)
+
+# SOQL templates, built once as single-line strings so only the variable parts
+# are formatted per call and query URLs stay short
+_USER_EMAIL_SOQL = "SELECT Email FROM User WHERE Id = '{user_id}' LIMIT 1"
+_CARRIER_BY_EMAIL_SOQL = (
+    "SELECT Id, Name, TFST_Contact_Person__c, TFST_Email__c, TFST_Contact_Number__c, "
+    "TFST_Service_Types__c, TFST_Reliability_Score__c, Is_Active__c "
+    "FROM TFST_Master_Carrier__c "
+    "WHERE TFST_Email__c = '{email}' "
+    "LIMIT 1"
+)
+_CARRIER_SHIPMENTS_SOQL = (
+    "SELECT {fields} "
+    "FROM TFST_Shipment__c "
+    "WHERE TFST_Carrier__c = '{carrier_id}' "
+    "AND TFST_Status__c NOT IN ('Delivered', 'Cancelled') "
+    "ORDER BY TFST_Predicted_Delivery_Date__c ASC"
+)
+_SHIPMENT_DETAILS_SOQL = (
+    f"SELECT {', '.join(SHIPMENT_DETAIL_FIELDS)} "
+    "FROM TFST_Shipment__c "
+    "WHERE {match} "
+    "LIMIT 1"
+)
+_SHIPMENT_DETAIL_FIELD_LIST = ','.join(SHIPMENT_DETAIL_FIELDS)
+_SHIPMENT_ID_BY_NAME_SOQL = "SELECT Id FROM TFST_Shipment__c WHERE Name = '{name}' LIMIT 1"
+_SHIPMENT_STAGES_SOQL = (
+    "SELECT Id, TFST_Shipment__c, TFST_Stage_Number__c, TFST_Stage_Type__c, "
+    "TFST_Status__c, TFST_Pickup_Location_Name__c, TFST_Delivery_Location_Name__c, "
+    "TFST_Scheduled_Start__c, TFST_Scheduled_End__c, "
+    "TFST_Actual_Start__c, TFST_Actual_End__c, "
+    "TFST_Carrier__c, TFST_Equipment_Type__c "
+    "FROM TFST_Shipment_Stage__c "
+    "WHERE TFST_Shipment__c {shipment_filter} "
+    "ORDER BY TFST_Stage_Number__c ASC"
+)
+# Relative date literal lets Salesforce use its CreatedDate index directly;
+# aliased aggregates come back as fields of a single record
+_CARRIER_PERFORMANCE_SOQL = (
+    "SELECT COUNT(Id) total_shipments, SUM(TFST_Total_Weight__c) total_weight "
+    "FROM TFST_Shipment__c "
+    "WHERE TFST_Carrier__c = '{carrier_id}' "
+    "AND CreatedDate = LAST_N_DAYS:{days}"
+)
+
+# Concurrent single-shipment lookups; stays under the session's connection pool size
+DETAIL_LOOKUP_WORKERS = 8
+_lookup_executor = ThreadPoolExecutor(max_workers=DETAIL_LOOKUP_WORKERS)
+
+# Lifetime assumed for user OAuth access tokens (seconds); Salesforce doesn't return one
+ACCESS_TOKEN_LIFETIME = 2 * 60 * 60
+
+# Refresh user access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+
+# Refreshes are single-flighted per refresh token through this many striped locks
+TOKEN_REFRESH_LOCK_STRIPES = 16
+
+# Redis key holding the system admin session shared by all workers; Salesforce
+# sessions idle out after 2 hours by default, so refresh the cached copy hourly
+SESSION_CACHE_KEY = 'sf:session'
+SESSION_CACHE_TTL = 3600
+
+# How often a connected worker checks Redis for a session renewed by another worker
+SESSION_RECHECK_INTERVAL = 300
+
+# Cache lifetimes (seconds); carrier records change rarely, shipments more often
+CARRIER_CACHE_TTL = 300
+USER_EMAIL_CACHE_TTL = 3600
+SHIPMENT_CACHE_TTL = 60
+
+# Rate limiting and gateway/server hiccups worth retrying
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+def _build_http_session() -> requests.Session:
+    """
+    HTTP session with a keep-alive connection pool and retries on transient errors
+    The adapter only retries idempotent methods; see retry_transient for safe POSTs
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=TRANSIENT_STATUSES)
+    )
+    session.mount('https://', adapter)
+    
+    # SOQL JSON compresses well; pin gzip so responses stay compressed even if
+    # another library overrides requests' default headers on this session
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def retry_transient(request: Callable[[], Any], max_attempts: int = 4,
+                    initial_delay: float = 0.2, backoff: float = 2.0) -> Any:
+    """
+    Call request(), retrying transient HTTP failures with jittered exponential backoff
+    Honors Retry-After; only for requests that are safe to repeat
+    """
+    delay = initial_delay
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return request()
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            response = getattr(e, 'response', None)
+            if isinstance(e, requests.HTTPError) and (response is None or response.status_code not in TRANSIENT_STATUSES):
+                raise
+            if attempt == max_attempts:
+                raise
+            
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            wait = float(retry_after) if retry_after and retry_after.isdigit() else delay * random.uniform(0.5, 1.5)
+            logger.warning(f"Transient Salesforce error ({str(e)}); retry {attempt} in {wait:.2f}s")
+            time.sleep(wait)
+            delay *= backoff
+
+def json_loads(content: bytes) -> Any:
+    """Decode a JSON response body"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(payload: Any) -> bytes:
+    """Encode a JSON request body"""
+    return orjson.dumps(payload) if orjson else json.dumps(payload).encode('utf-8')
+
+def utc_now_iso() -> str:
+    """Current UTC time as a timezone-aware ISO 8601 string"""
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+def format_coordinates(location: Dict[str, Any]) -> str:
+    """'lat,lng' string with fixed 6-decimal precision (~0.1 m)"""
+    return f"{float(location.get('lat', 0)):.6f},{float(location.get('lng', 0)):.6f}"
+
+# Escape single quotes and backslashes in one pass
+_SOQL_ESCAPES = str.maketrans({'\\': '\\\\', '\'': '\\\''})
+
 def escape_soql(value: str) -> str:
     """Sanitizes a string for use in a SOQL query to prevent SOQL injection."""
     if value is None:
         return "NULL"
-    # Escape single quotes and backslashes
-    return str(value).replace('\\', '\\\\').replace('\'', '\\\'')
+    return str(value).translate(_SOQL_ESCAPES)
+
+_SALESFORCE_ID_RE = re.compile(r'[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?')
+
+def is_salesforce_id(value: str) -> bool:
+    """Whether a value has the shape of a 15 or 18 character Salesforce record ID"""
+    return value is not None and _SALESFORCE_ID_RE.fullmatch(str(value)) is not None
+
+def soql_id(value: str) -> str:
+    """Validates a Salesforce record ID for use in a SOQL query; IDs need no escaping."""
+    if not is_salesforce_id(value):
+        raise ValueError(f"Invalid Salesforce ID: {value!r}")
+    return str(value)
 
 class TFST_SalesforceService:
     """
@@ -30,12 +253,53 @@ class TFST_SalesforceService:
         self.access_token = None
         self.instance_url = None
         self._initialized = False
+        self._session_checked_at = 0.0
+        
+        # OAuth settings snapshot, taken from the app config on first use
+        self._cfg = None
+        self._cfg_app_id = None
+        
+        # Serializes the first login so concurrent requests don't each authenticate
+        self._init_lock = threading.Lock()
+        
+        # Tracking records waiting for the background flusher (TRACKING_BATCH_ENABLED)
+        self._tracking_buffer = queue.Queue()
+        self._tracking_flush_now = threading.Event()
+        self._tracking_flusher = None
+        self._tracking_app = None
+        self._tracking_lock = threading.Lock()
+        
+        # Shared by OAuth calls and the simple_salesforce client so TLS connections are reused
+        self._session = _build_http_session()
+        
+        # Read-through caches for hot lookups, shared between workers through Redis when configured.
+        # Shipments are edited through the portal, so their caches read Redis directly and a
+        # status update's invalidation reaches every worker
+        shared = dict(store=self._shared_store, dumps=json_dumps, loads=json_loads)
+        self._carrier_cache = SharedTTLCache('sf:carrier:', maxsize=1024, ttl=CARRIER_CACHE_TTL, **shared)  # user_id -> carrier record
+        self._user_email_cache = SharedTTLCache('sf:email:', maxsize=1024, ttl=USER_EMAIL_CACHE_TTL, **shared)  # user_id -> User.Email
+        self._shipment_cache = SharedTTLCache('sf:ship:', maxsize=1024, ttl=SHIPMENT_CACHE_TTL, local=False, **shared)  # shipment Id and Name -> record
+        self._stages_cache = SharedTTLCache('sf:stages:', maxsize=1024, ttl=SHIPMENT_CACHE_TTL, local=False, **shared)  # shipment Id -> stages
+        self._refreshed_tokens = SharedTTLCache(
+            'sf:token:', maxsize=1024, ttl=ACCESS_TOKEN_LIFETIME - TOKEN_REFRESH_MARGIN, **shared
+        )  # refresh token digest -> refreshed access token
+        self._refresh_locks = [threading.Lock() for _ in range(TOKEN_REFRESH_LOCK_STRIPES)]
     
     def _initialize_connection(self):
         """Initialize Salesforce connection using system admin credentials if not already initialized"""
         if self._initialized:
+            if time.monotonic() - self._session_checked_at > SESSION_RECHECK_INTERVAL:
+                self._adopt_shared_session()
             return
-            
+        
+        with self._init_lock:
+            # Another thread may have finished logging in while we waited
+            if self._initialized:
+                return
+            self._connect()
+    
+    def _connect(self, use_cached_session: bool = True):
+        """Log in with the system admin credentials; only marks initialized on success"""
         try:
             from flask import current_app
             
@@ -46,61 +310,168 @@ class TFST_SalesforceService:
             ]):
                 logger.warning("Salesforce credentials not configured, skipping connection")
                 return
-                
-            self.sf = Salesforce(
-                username=current_app.config['SALESFORCE_USERNAME'],
-                password=current_app.config['SALESFORCE_PASSWORD'],
-                security_token=current_app.config['SALESFORCE_SECURITY_TOKEN'],
-                domain='test' if 'test.salesforce.com' in current_app.config['SALESFORCE_LOGIN_URL'] else 'login'
-            )
+            
+            # Adopt a session another worker already opened rather than logging in again
+            cached = self._load_shared_session() if use_cached_session else None
+            if cached:
+                self.sf = _simple_salesforce().Salesforce(
+                    instance=cached['instance'],
+                    session_id=cached['session_id'],
+                    session=self._session
+                )
+            else:
+                self.sf = _simple_salesforce().Salesforce(
+                    username=current_app.config['SALESFORCE_USERNAME'],
+                    password=current_app.config['SALESFORCE_PASSWORD'],
+                    security_token=current_app.config['SALESFORCE_SECURITY_TOKEN'],
+                    domain='test' if 'test.salesforce.com' in current_app.config['SALESFORCE_LOGIN_URL'] else 'login',
+                    session=self._session
+                )
+                self._store_shared_session()
+            
             self.access_token = self.sf.session_id
             self.instance_url = self.sf.sf_instance
+            self._session_checked_at = time.monotonic()
             self._initialized = True
             logger.info("Salesforce connection initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Salesforce connection: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception("Failed to initialize Salesforce connection")
             # Don't raise in debug mode
             if not current_app.config.get('DEBUG', False):
                 raise
     
+    def _shared_store(self):
+        """Redis client configured for Flask-Session, if any"""
+        if not has_app_context() or not current_app.config.get('REDIS_URL'):
+            return None
+        return current_app.config.get('SESSION_REDIS')
+    
+    def _load_shared_session(self) -> Optional[Dict[str, str]]:
+        """Session id and instance cached by any worker, or None"""
+        store = self._shared_store()
+        if store is None:
+            return None
+        
+        try:
+            cached = store.get(SESSION_CACHE_KEY)
+            return json_loads(cached) if cached else None
+        except (redis.RedisError, ValueError) as e:
+            logger.warning(f"Could not read shared Salesforce session: {str(e)}")
+            return None
+    
+    def _store_shared_session(self):
+        """Publish the current session so other workers can skip the login"""
+        store = self._shared_store()
+        if store is None:
+            return
+        
+        try:
+            store.set(SESSION_CACHE_KEY,
+                      json_dumps({'session_id': self.sf.session_id, 'instance': self.sf.sf_instance}),
+                      ex=SESSION_CACHE_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Could not share Salesforce session: {str(e)}")
+    
+    def _adopt_shared_session(self):
+        """
+        Switch to the shared session if another worker has renewed it, so this
+        worker doesn't discover the expiry through a failed call and log in again
+        """
+        with self._init_lock:
+            if time.monotonic() - self._session_checked_at <= SESSION_RECHECK_INTERVAL:
+                return
+            self._session_checked_at = time.monotonic()
+            
+            cached = self._load_shared_session()
+            if not cached or cached['session_id'] == self.sf.session_id:
+                return
+            
+            self.sf = _simple_salesforce().Salesforce(
+                instance=cached['instance'], session_id=cached['session_id'], session=self._session
+            )
+            self.access_token = self.sf.session_id
+            self.instance_url = self.sf.sf_instance
+            logger.info("Adopted renewed Salesforce session from shared cache")
+    
+    def _renew_session(self, expired_session_id: str):
+        """Log in again after a 401, unless another thread already has"""
+        with self._init_lock:
+            if self.sf is not None and self.sf.session_id != expired_session_id:
+                return
+            
+            logger.info("Salesforce session expired, logging in again")
+            self._initialized = False
+            self._connect(use_cached_session=False)
+    
+    def _call(self, request: Callable[[], Any]) -> Any:
+        """
+        Run a Salesforce request, renewing the session and retrying once if it has expired
+        `request` must read self.sf when called so the retry uses the new session
+        """
+        if self.sf is None:
+            raise SalesforceServiceError("Salesforce connection not available")
+        
+        session_id = self.sf.session_id
+        try:
+            return request()
+        except _simple_salesforce().SalesforceExpiredSession:
+            pass
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 401:
+                raise
+        
+        self._renew_session(session_id)
+        return request()
+    
+    def _oauth_config(self) -> types.SimpleNamespace:
+        """
+        OAuth settings, read from the app config once per app instead of on every call
+        The authorize URL and token grant bodies are prebuilt; callers add only per-request values
+        """
+        app = current_app._get_current_object()
+        if self._cfg is None or self._cfg_app_id != id(app):
+            cfg = app.config
+            client = {'client_id': cfg['SALESFORCE_CLIENT_ID'], 'client_secret': cfg['SALESFORCE_CLIENT_SECRET']}
+            authorize_params = {
+                **_OAUTH_STATIC_PARAMS,
+                'client_id': cfg['SALESFORCE_CLIENT_ID'],
+                'redirect_uri': cfg['SALESFORCE_REDIRECT_URI']
+            }
+            self._cfg = types.SimpleNamespace(
+                login_url=cfg['SALESFORCE_LOGIN_URL'],
+                client_id=cfg['SALESFORCE_CLIENT_ID'],
+                client_secret=cfg['SALESFORCE_CLIENT_SECRET'],
+                redirect_uri=cfg['SALESFORCE_REDIRECT_URI'],
+                token_url=f"{cfg['SALESFORCE_LOGIN_URL']}/services/oauth2/token",
+                # Percent-encode values; redirect URIs contain reserved characters
+                authorize_url=(f"{cfg['SALESFORCE_LOGIN_URL']}/services/oauth2/authorize?"
+                               f"{urlencode(authorize_params, quote_via=quote)}"),
+                code_grant={'grant_type': 'authorization_code', **client,
+                            'redirect_uri': cfg['SALESFORCE_REDIRECT_URI']},
+                refresh_grant={'grant_type': 'refresh_token', **client}
+            )
+            self._cfg_app_id = id(app)
+        return self._cfg
+    
     # Then add this initialization check to every method
     def get_oauth_url(self, state: str = None) -> str:
         """
         Generate Salesforce OAuth authorization URL for user login
         """
-        from flask import current_app
-        
-        params = {
-            'response_type': 'code',
-            'client_id': current_app.config['SALESFORCE_CLIENT_ID'],
-            'redirect_uri': current_app.config['SALESFORCE_REDIRECT_URI'],
-            'scope': 'api id profile email address phone offline_access'
-        }
-        
+        oauth_url = self._oauth_config().authorize_url
         if state:
-            params['state'] = state
-        
-        query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-        oauth_url = f"{current_app.config['SALESFORCE_LOGIN_URL']}/services/oauth2/authorize?{query_string}"
-        
+            oauth_url += f"&state={quote(state, safe='')}"
         return oauth_url
     
     def exchange_code_for_token(self, code: str) -> Dict[str, Any]:
         """
         Exchange authorization code for access token
         """
-        token_url = f"{current_app.config['SALESFORCE_LOGIN_URL']}/services/oauth2/token"
-        
-        data = {
-            'grant_type': 'authorization_code',
-            'client_id': current_app.config['SALESFORCE_CLIENT_ID'],
-            'client_secret': current_app.config['SALESFORCE_CLIENT_SECRET'],
-            'redirect_uri': current_app.config['SALESFORCE_REDIRECT_URI'],
-            'code': code
-        }
+        cfg = self._oauth_config()
+        data = {**cfg.code_grant, 'code': code}
         
         try:
-            response = requests.post(token_url, data=data)
+            response = self._session.post(cfg.token_url, data=data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -111,18 +482,17 @@ class TFST_SalesforceService:
         """
         Refresh access token using refresh token
         """
-        token_url = f"{current_app.config['SALESFORCE_LOGIN_URL']}/services/oauth2/token"
+        cfg = self._oauth_config()
+        data = {**cfg.refresh_grant, 'refresh_token': refresh_token}
 
-        data = {
-            'grant_type': 'refresh_token',
-            'client_id': current_app.config['SALESFORCE_CLIENT_ID'],
-            'client_secret': current_app.config['SALESFORCE_CLIENT_SECRET'],
-            'refresh_token': refresh_token
-        }
-
-        try:
-            response = requests.post(token_url, data=data)
+        def post():
+            response = self._session.post(cfg.token_url, data=data)
             response.raise_for_status()
+            return response
+        
+        try:
+            # Refresh tokens are reusable, so a failed refresh can safely be retried
+            response = retry_transient(post)
             # Note: A new refresh token is NOT issued in this response
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -130,6 +500,28 @@ class TFST_SalesforceService:
             # If refresh fails, the user might need to log in again
             raise
     
+    def refresh_access_token_shared(self, refresh_token: str) -> Dict[str, Any]:
+        """
+        Refresh access token once across workers: concurrent requests holding the same
+        refresh token reuse the first result instead of each hitting the token endpoint
+        Adds 'expires_ts' (epoch seconds) to the token response
+        """
+        key = hashlib.sha256(refresh_token.encode()).hexdigest()
+        token = self._refreshed_tokens.get(key)
+        if token and token['expires_ts'] - time.time() > TOKEN_REFRESH_MARGIN:
+            return token
+        
+        # Requests in this worker wait for one refresh rather than racing their own
+        with self._refresh_locks[int(key[:8], 16) % TOKEN_REFRESH_LOCK_STRIPES]:
+            token = self._refreshed_tokens.get(key)
+            if token and token['expires_ts'] - time.time() > TOKEN_REFRESH_MARGIN:
+                return token
+            
+            token = self.refresh_access_token(refresh_token)
+            token['expires_ts'] = int(time.time()) + ACCESS_TOKEN_LIFETIME
+            self._refreshed_tokens.set(key, token)
+            return token
+    
     def get_user_info(self, access_token: str, instance_url: str) -> Dict[str, Any]:
         """
         Get user information from Salesforce using access token
@@ -143,17 +535,22 @@ class TFST_SalesforceService:
             self._initialize_connection()
             # Get user ID from token
             identity_url = f"{instance_url}/services/oauth2/userinfo"
-            response = requests.get(identity_url, headers=headers)
+            response = self._session.get(identity_url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to get user info: {str(e)}")
             raise
 
-    def get_carrier_info(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_carrier_info(self, user_id: str, email: str = None) -> Optional[Dict[str, Any]]:
         """
         Get carrier information for a specific user from TFST_Master_Carrier
+        Pass the user's email when already known (e.g. from userinfo) to skip the User lookup
         """
+        cached = self._carrier_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
             # Make sure Salesforce connection is initialized
             self._initialize_connection()
@@ -162,38 +559,35 @@ class TFST_SalesforceService:
                 logger.error("Salesforce connection not available.")
                 return None
 
-            # Sanitize input to prevent SOQL injection
-            safe_user_id = escape_soql(user_id)
-            
-            # First get the user's email from Salesforce
-            user_query = f"SELECT Email FROM User WHERE Id = '{safe_user_id}' LIMIT 1"
-            user_result = self.sf.query(user_query)
-            
-            if user_result['totalSize'] == 0:
-                logger.error(f"User not found: {user_id}")
-                return None
+            # SOQL semi-joins only match ID/reference fields, so an email
+            # cannot be joined from User; look it up only when not supplied or cached
+            user_email = email or self._user_email_cache.get(user_id)
+            if not user_email:
+                user_query = _USER_EMAIL_SOQL.format(user_id=soql_id(user_id))
+                user_result = self._call(lambda: self.sf.query(user_query))
                 
-            user_email = user_result['records'][0]['Email']
-            safe_user_email = escape_soql(user_email)
+                if user_result['totalSize'] == 0:
+                    logger.error(f"User not found: {user_id}")
+                    return None
+                    
+                user_email = user_result['records'][0]['Email']
+                self._user_email_cache.set(user_id, user_email)
             
             # Then query carrier by email
-            carrier_query = f"""
-                SELECT Id, Name, TFST_Contact_Person__c, TFST_Email__c, TFST_Contact_Number__c,
-                    TFST_Service_Types__c, TFST_Reliability_Score__c, Is_Active__c
-                FROM TFST_Master_Carrier__c 
-                WHERE TFST_Email__c = '{safe_user_email}'
-                LIMIT 1
-            """
+            carrier_query = _CARRIER_BY_EMAIL_SOQL.format(email=escape_soql(user_email))
             
-            result = self.sf.query(carrier_query)
+            result = self._call(lambda: self.sf.query(carrier_query))
             
             if result['totalSize'] > 0:
-                return result['records'][0]
+                carrier = result['records'][0]
+                self._carrier_cache.set(user_id, carrier)
+                return carrier
             return None
                 
-        except Exception as e:
-            logger.error(f"Failed to get carrier info for user {user_id}: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get carrier info for user {user_id}")
             return None
+    
     def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
         Get portal user information from Salesforce by Salesforce User ID
@@ -201,10 +595,10 @@ class TFST_SalesforceService:
         self._initialize_connection()
         try:
             # This assumes you have a custom object `Portal_User__c` with an external ID field `Salesforce_User_Id__c`
-            result = self.sf.Portal_User__c.get_by_custom_id('Salesforce_User_Id__c', user_id)
+            result = self._call(lambda: self.sf.Portal_User__c.get_by_custom_id('Salesforce_User_Id__c', user_id))
             return result
-        except Exception as e:
-            logger.error(f"Failed to get portal user by id {user_id}: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get portal user by id {user_id}")
             return None
 
     def create_or_update_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -232,71 +626,133 @@ class TFST_SalesforceService:
         }
 
         try:
-            # Upsert user data based on the external ID `Salesforce_User_Id__c`
-            result = self.sf.Portal_User__c.upsert(f'Salesforce_User_Id__c/{salesforce_user_id}', sf_data)
-            logger.info(f"Upserted portal user {salesforce_user_id}. Status: {result}")
-
-            # After upserting, fetch the full record to return it, ensuring consistency
-            return self.get_user_by_id(salesforce_user_id)
-        except Exception as e:
-            logger.error(f"Failed to upsert portal user {salesforce_user_id}: {str(e)}")
+            # Upsert on the external ID `Salesforce_User_Id__c`, then read the full record
+            # back, in one Composite call; allOrNone skips the read if the upsert fails
+            record_url = (f"/services/data/v{self.sf.sf_version}/sobjects/Portal_User__c/"
+                          f"Salesforce_User_Id__c/{quote(salesforce_user_id, safe='')}")
+            payload = {
+                'allOrNone': True,
+                'compositeRequest': [
+                    {'method': 'PATCH', 'url': record_url, 'referenceId': 'upsertUser', 'body': sf_data},
+                    {'method': 'GET', 'url': record_url, 'referenceId': 'portalUser'}
+                ]
+            }
+            response = self._rest('POST', 'composite', payload=payload)
+            upserted, fetched = response['compositeResponse']
+            
+            if upserted['httpStatusCode'] >= 300:
+                raise SalesforceServiceError(f"Upsert failed ({upserted['httpStatusCode']}): {upserted['body']}")
+            logger.info(f"Upserted portal user {salesforce_user_id}. Status: {upserted['httpStatusCode']}")
+            
+            return fetched['body'] if fetched['httpStatusCode'] == 200 else None
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to upsert portal user {salesforce_user_id}")
             raise
 
-    def get_carrier_shipments(self, carrier_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+    def get_carrier_shipments(self, carrier_id: str, limit: int = 100,
+                              fields: tuple = SHIPMENT_FIELDS) -> List[Dict[str, Any]]:
         """
         Get shipments assigned to a specific carrier
+        Pass a narrower `fields` projection when only a few columns are needed
         """
         try:
-            safe_carrier_id = escape_soql(carrier_id)
-            query = f"""
-                SELECT Id, Name, TFST_Shipment_Type__c, TFST_Status__c, TFST_Carrier__c,
-                       TFST_Current_Coordinates__c, TFST_Driver_Name__c, TFST_Driver_Phone__c,
-                       TFST_Predicted_Delivery_Date__c, TFST_Project_Reference__c,
-                       Required_Delivery_Date__c, TFST_Total_Weight__c, TFST_Total_Volume__c,
-                       TFST_Service_Level__c, TFST_Current_Speed__c, TFST_GPS_Enabled__c
-                FROM TFST_Shipment__c
-                WHERE TFST_Carrier__c = '{safe_carrier_id}'
-                   AND TFST_Status__c NOT IN ('Delivered', 'Cancelled')
-                ORDER BY TFST_Predicted_Delivery_Date__c ASC
-                LIMIT {limit}
-            """
-            
-            result = self.sf.query(query)
-            return result['records']
+            return list(self.iter_carrier_shipments(carrier_id, fields=fields, limit=limit))
             
-        except Exception as e:
-            logger.error(f"Failed to get shipments for carrier {carrier_id}: {str(e)}")
+        except KeyError:
+            logger.exception(f"Malformed shipments response for carrier {carrier_id}")
+            return []
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get shipments for carrier {carrier_id}")
             return []
     
+    def iter_carrier_shipments(self, carrier_id: str, fields: tuple = SHIPMENT_FIELDS,
+                               limit: Optional[int] = None, batch_size: int = 2000) -> Iterator[Dict[str, Any]]:
+        """
+        Yield a carrier's active shipments batch by batch, following nextRecordsUrl
+        Only one batch of records is held in memory at a time
+        """
+        self._initialize_connection()
+        
+        query = self._carrier_shipments_soql(carrier_id, fields, limit)
+        headers = {'Sforce-Query-Options': f'batchSize={batch_size}'}
+        result = self._rest('GET', 'query/', params={'q': query}, headers=headers)
+        while True:
+            yield from result['records']
+            if result.get('done', True):
+                break
+            result = self._rest('GET', f"https://{self.sf.sf_instance}{result['nextRecordsUrl']}", headers=headers)
+    
+    def _carrier_shipments_soql(self, carrier_id: str, fields: tuple, limit: Optional[int]) -> str:
+        """SOQL for a carrier's active shipments, soonest predicted delivery first"""
+        query = _CARRIER_SHIPMENTS_SOQL.format(fields=', '.join(fields), carrier_id=soql_id(carrier_id))
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return query
+    
     def get_shipment_details(self, shipment_id: str) -> Optional[Dict[str, Any]]:
         """
         Get detailed information for a specific shipment
         """
+        cached = self._shipment_cache.get(shipment_id)
+        if cached is not None:
+            return cached
+        
         try:
-            safe_shipment_id = escape_soql(shipment_id)
-            query = f"""
-                SELECT Id, Name, TFST_Shipment_Type__c, TFST_Status__c, TFST_Carrier__c,
-                       TFST_Current_Coordinates__c, TFST_Driver_Name__c, TFST_Driver_Phone__c,
-                       TFST_Predicted_Delivery_Date__c, TFST_Project_Reference__c,
-                       Required_Delivery_Date__c, TFST_Total_Weight__c, TFST_Total_Volume__c,
-                       TFST_Service_Level__c, TFST_Current_Speed__c, TFST_GPS_Enabled__c,
-                       Special_Instructions__c, TFST_Transportation_Request__c,
-                       TFST_Quote_Request__c, TFST_Service_Order_Number__c
-                FROM TFST_Shipment__c
-                WHERE Id = '{safe_shipment_id}' OR Name = '{safe_shipment_id}'
-                LIMIT 1
-            """
-            
-            result = self.sf.query(query)
+            self._initialize_connection()
+            
+            # Record IDs are read straight from the sObject endpoint, skipping SOQL parsing;
+            # Names still need a query
+            if is_salesforce_id(shipment_id):
+                return self._cache_shipment(self._rest(
+                    'GET', f"sobjects/TFST_Shipment__c/{shipment_id}",
+                    params={'fields': _SHIPMENT_DETAIL_FIELD_LIST}
+                ))
+            
+            result = self._call(lambda: self.sf.query(self._shipment_details_soql(shipment_id)))
             
             if result['totalSize'] > 0:
-                return result['records'][0]
+                return self._cache_shipment(result['records'][0])
             return None
             
-        except Exception as e:
-            logger.error(f"Failed to get shipment details for {shipment_id}: {str(e)}")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (400, 404):
+                # Unknown or malformed record ID
+                return None
+            logger.exception(f"Failed to get shipment details for {shipment_id}")
+            return None
+        except KeyError:
+            logger.exception(f"Malformed shipment details response for {shipment_id}")
+            return None
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get shipment details for {shipment_id}")
             return None
     
+    def get_shipments_details(self, shipment_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get details for many shipments, keyed by the identifier passed in
+        Cache misses are fetched concurrently so wall time is about one round trip
+        """
+        details = {}
+        missing = []
+        for shipment_id in dict.fromkeys(shipment_ids):
+            cached = self._shipment_cache.get(shipment_id)
+            if cached is not None:
+                details[shipment_id] = cached
+            else:
+                missing.append(shipment_id)
+        
+        if missing:
+            self._initialize_connection()
+            app = current_app._get_current_object()
+            
+            def fetch(shipment_id):
+                with app.app_context():
+                    return self.get_shipment_details(shipment_id)
+            
+            details.update(zip(missing, _lookup_executor.map(fetch, missing)))
+        
+        return details
+    
     def update_shipment_status(self, shipment_id: str, status: str, 
                              location: Dict[str, float] = None, 
                              driver_info: Dict[str, str] = None) -> bool:
@@ -304,121 +760,398 @@ class TFST_SalesforceService:
         Update shipment status in Salesforce
         """
         try:
-            update_data = {
-                'TFST_Status__c': status,
-                'TFST_Last_Location_Time__c': datetime.utcnow().isoformat()
-            }
+            update_data = self._status_update_fields(status, location, driver_info)
             
-            if location:
-                update_data['TFST_Current_Coordinates__c'] = f"{location.get('lat', 0)},{location.get('lng', 0)}"
+            # Handle different ID formats (Salesforce ID vs Name)
+            record_id = self._resolve_shipment_id(shipment_id)
+            if not record_id:
+                logger.error(f"Shipment not found: {shipment_id}")
+                return False
             
-            if driver_info:
-                if 'name' in driver_info:
-                    update_data['TFST_Driver_Name__c'] = driver_info['name']
-                if 'phone' in driver_info:
-                    update_data['TFST_Driver_Phone__c'] = driver_info['phone']
+            result = self._call(lambda: self.sf.TFST_Shipment__c.update(record_id, update_data))
             
-            # Handle different ID formats (Salesforce ID vs Name)
-            if len(shipment_id) == 18 or len(shipment_id) == 15:
-                # Salesforce ID format
-                result = self.sf.TFST_Shipment__c.update(shipment_id, update_data)
-            else:
-                # Shipment Name format - need to find the record first
-                shipment = self.get_shipment_details(shipment_id)
-                if shipment:
-                    result = self.sf.TFST_Shipment__c.update(shipment['Id'], update_data)
-                else:
-                    logger.error(f"Shipment not found: {shipment_id}")
-                    return False
+            self.invalidate_shipment(shipment_id)
             
             logger.info(f"Updated shipment {shipment_id} status to {status}")
             return True
             
-        except Exception as e:
-            logger.error(f"Failed to update shipment {shipment_id}: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to update shipment {shipment_id}")
             return False
     
+    def update_shipments_status_bulk(self, updates: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Update many shipment statuses through sObject Collections, 200 records per call
+        Each update needs the shipment's record Id under 'shipment_id' plus 'status',
+        and optionally 'location' and 'driver_info'. Returns per-update success in order
+        """
+        # One timestamp serves the whole batch
+        now_iso = utc_now_iso()
+        records = [
+            {'Id': soql_id(update['shipment_id']),
+             **self._status_update_fields(update['status'], update.get('location'),
+                                          update.get('driver_info'), now_iso)}
+            for update in updates
+        ]
+        
+        results = self._sobject_collection('PATCH', 'TFST_Shipment__c', records)
+        
+        for update, success in zip(updates, results):
+            if success:
+                self.invalidate_shipment(update['shipment_id'])
+        
+        logger.info(f"Bulk updated {sum(results)} of {len(updates)} shipment statuses")
+        return results
+    
+    def _status_update_fields(self, status: str, location: Dict[str, float] = None,
+                              driver_info: Dict[str, str] = None, now_iso: str = None) -> Dict[str, Any]:
+        """TFST_Shipment__c field values for a status update"""
+        update_data = {
+            'TFST_Status__c': status,
+            'TFST_Last_Location_Time__c': now_iso or utc_now_iso()
+        }
+        
+        if location:
+            update_data['TFST_Current_Coordinates__c'] = format_coordinates(location)
+        
+        if driver_info:
+            if 'name' in driver_info:
+                update_data['TFST_Driver_Name__c'] = driver_info['name']
+            if 'phone' in driver_info:
+                update_data['TFST_Driver_Phone__c'] = driver_info['phone']
+        
+        return update_data
+    
+    def _sobject_collection(self, method: str, sobject_type: str, records: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Create (POST) or update (PATCH) records through sObject Collections
+        Records succeed or fail individually; returns per-record success in order
+        """
+        self._initialize_connection()
+        
+        results = []
+        for start in range(0, len(records), SOBJECT_COLLECTION_LIMIT):
+            chunk = records[start:start + SOBJECT_COLLECTION_LIMIT]
+            payload = {
+                'allOrNone': False,
+                'records': [{'attributes': {'type': sobject_type}, **record} for record in chunk]
+            }
+            
+            try:
+                response = self._rest(method, 'composite/sobjects', payload=payload)
+            except SALESFORCE_ERRORS:
+                logger.exception(f"{sobject_type} collection {method} failed")
+                results.extend([False] * len(chunk))
+                continue
+            
+            for record_result in response:
+                if not record_result.get('success'):
+                    logger.error(f"{sobject_type} collection {method} record error: {record_result.get('errors')}")
+                results.append(bool(record_result.get('success')))
+        
+        return results
+    
+    def _cache_shipment(self, shipment: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache a shipment record under both its Id and Name"""
+        self._shipment_cache.set(shipment['Id'], shipment)
+        if shipment.get('Name'):
+            self._shipment_cache.set(shipment['Name'], shipment)
+        return shipment
+    
+    def _resolve_shipment_id(self, shipment_id: str) -> Optional[str]:
+        """
+        Record Id for a shipment Id or Name
+        IDs pass through; Names use the detail cache, else an Id-only lookup on Name
+        """
+        if is_salesforce_id(shipment_id):
+            return shipment_id
+        
+        cached = self._shipment_cache.get(shipment_id)
+        if cached is not None:
+            return cached['Id']
+        
+        query = _SHIPMENT_ID_BY_NAME_SOQL.format(name=escape_soql(shipment_id))
+        result = self._call(lambda: self.sf.query(query))
+        return result['records'][0]['Id'] if result['totalSize'] > 0 else None
+    
+    def invalidate_shipment(self, shipment_id: str):
+        """Drop cached details for a shipment, whichever identifier it was cached under"""
+        cached = self._shipment_cache.get(shipment_id)
+        self._shipment_cache.invalidate(shipment_id)
+        if cached is not None:
+            self._shipment_cache.invalidate(cached.get('Id'))
+            self._shipment_cache.invalidate(cached.get('Name'))
+    
+    def _shipment_match(self, shipment_id: str) -> str:
+        """
+        SOQL condition selecting a shipment by Salesforce ID or by Name
+        Filtering on one field (no OR) keeps the query selective and avoids
+        comparing a Name against the Id field, which Salesforce rejects
+        """
+        if is_salesforce_id(shipment_id):
+            return f"Id = '{soql_id(shipment_id)}'"
+        return f"Name = '{escape_soql(shipment_id)}'"
+    
+    def _shipment_details_soql(self, shipment_id: str) -> str:
+        """SOQL for a single shipment matched by Salesforce ID or Name"""
+        return _SHIPMENT_DETAILS_SOQL.format(match=self._shipment_match(shipment_id))
+    
+    def _shipment_stages_soql(self, shipment_filter: str) -> str:
+        """SOQL for the stages of the shipment(s) matched by a TFST_Shipment__c filter"""
+        return _SHIPMENT_STAGES_SOQL.format(shipment_filter=shipment_filter)
+    
     def get_shipment_stages(self, shipment_id: str) -> List[Dict[str, Any]]:
         """
         Get shipment stages for tracking
         """
+        cached = self._stages_cache.get(shipment_id)
+        if cached is not None:
+            return cached
+        
         try:
-            safe_shipment_id = escape_soql(shipment_id)
-            query = f"""
-                SELECT Id, TFST_Shipment__c, TFST_Stage_Number__c, TFST_Stage_Type__c,
-                       TFST_Status__c, TFST_Pickup_Location_Name__c, TFST_Delivery_Location_Name__c,
-                       TFST_Scheduled_Start__c, TFST_Scheduled_End__c,
-                       TFST_Actual_Start__c, TFST_Actual_End__c,
-                       TFST_Carrier__c, TFST_Equipment_Type__c
-                FROM TFST_Shipment_Stage__c
-                WHERE TFST_Shipment__c = '{safe_shipment_id}'
-                ORDER BY TFST_Stage_Number__c ASC
-            """
-            
-            result = self.sf.query(query)
+            result = self._call(lambda: self.sf.query(self._shipment_stages_soql(f"= '{soql_id(shipment_id)}'")))
+            self._stages_cache.set(shipment_id, result['records'])
             return result['records']
             
-        except Exception as e:
-            logger.error(f"Failed to get shipment stages for {shipment_id}: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get shipment stages for {shipment_id}")
             return []
     
     def create_tracking_record(self, shipment_id: str, event_data: Dict[str, Any]) -> bool:
         """
         Create a tracking record in TFST_Tracking__c
+        With TRACKING_BATCH_ENABLED the record is queued and created by the background flusher
         """
         try:
-            tracking_data = {
-                'TFST_Shipment__c': shipment_id,
-                'TFST_Tracking_Event__c': event_data.get('status', 'Update'),
-                'TFST_Current_Status__c': event_data.get('status'),
-                'Time_of_Event__c': event_data.get('timestamp', datetime.utcnow().isoformat()),
-                'TFST_Coordinates__c': f"{event_data.get('location', {}).get('lat', 0)},{event_data.get('location', {}).get('lng', 0)}",
-                'TFST_Last_Update_Time__c': datetime.utcnow().isoformat(),
-                'TFST_Event_Source__c': 'Carrier Portal'
-            }
+            tracking_data = self._tracking_record_fields(shipment_id, event_data)
             
-            if 'notes' in event_data:
-                tracking_data['TFST_Route_Details__c'] = event_data['notes']
+            if current_app.config.get('TRACKING_BATCH_ENABLED'):
+                self._enqueue_tracking_record(tracking_data)
+                return True
             
-            result = self.sf.TFST_Tracking__c.create(tracking_data)
+            result = self._call(lambda: self.sf.TFST_Tracking__c.create(tracking_data))
             logger.info(f"Created tracking record for shipment {shipment_id}")
             return True
             
-        except Exception as e:
-            logger.error(f"Failed to create tracking record for {shipment_id}: {str(e)}")
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to create tracking record for {shipment_id}")
             return False
     
+    def _carrier_performance_soql(self, carrier_id: str, days: int) -> str:
+        """SOQL aggregating a carrier's shipments created in the last `days` days"""
+        return _CARRIER_PERFORMANCE_SOQL.format(carrier_id=soql_id(carrier_id), days=int(days))
+    
+    def _performance_metrics(self, result: Dict[str, Any], carrier_id: str, days: int) -> Dict[str, Any]:
+        """Shape an aggregate performance query result"""
+        aggregates = result['records'][0] if result.get('records') else {}
+        return {
+            'total_shipments': aggregates.get('total_shipments') or 0,
+            'total_weight': aggregates.get('total_weight') or 0,
+            'period_days': days,
+            'carrier_id': carrier_id
+        }
+    
+    def create_tracking_records_bulk(self, events: List[Tuple[str, Dict[str, Any]]]) -> List[bool]:
+        """
+        Create tracking records for (shipment_id, event_data) pairs, 200 per call
+        Returns per-record success in order
+        """
+        now_iso = utc_now_iso()
+        records = [self._tracking_record_fields(shipment_id, event_data, now_iso) for shipment_id, event_data in events]
+        results = self._sobject_collection('POST', 'TFST_Tracking__c', records)
+        
+        logger.info(f"Bulk created {sum(results)} of {len(events)} tracking records")
+        return results
+    
+    def _enqueue_tracking_record(self, tracking_data: Dict[str, Any]):
+        """Queue a tracking record, starting the flusher on first use"""
+        if self._tracking_flusher is None:
+            with self._tracking_lock:
+                if self._tracking_flusher is None:
+                    self._tracking_app = current_app._get_current_object()
+                    self._tracking_flusher = threading.Thread(
+                        target=self._run_tracking_flusher, name='sf-tracking-flusher', daemon=True
+                    )
+                    self._tracking_flusher.start()
+                    atexit.register(self.flush_tracking_records)
+        
+        self._tracking_buffer.put(tracking_data)
+        
+        # A full collection's worth is waiting; don't hold it for the interval
+        if self._tracking_buffer.qsize() >= SOBJECT_COLLECTION_LIMIT:
+            self._tracking_flush_now.set()
+    
+    def _run_tracking_flusher(self):
+        """Flush queued tracking records every TRACKING_BATCH_INTERVAL seconds, or sooner when full"""
+        interval = self._tracking_app.config.get('TRACKING_BATCH_INTERVAL', 5)
+        while True:
+            self._tracking_flush_now.wait(interval)
+            self._tracking_flush_now.clear()
+            try:
+                self.flush_tracking_records()
+            except Exception:
+                # Keep the flusher alive; the failed batch has already been logged
+                logger.exception("Tracking record flush failed")
+    
+    def flush_tracking_records(self):
+        """Create all queued tracking records, one sObject Collection call per 200"""
+        if self._tracking_app is None:
+            return
+        
+        while True:
+            records = []
+            while len(records) < SOBJECT_COLLECTION_LIMIT:
+                try:
+                    records.append(self._tracking_buffer.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if not records:
+                return
+            
+            with self._tracking_app.app_context():
+                self._initialize_connection()
+                results = self._sobject_collection('POST', 'TFST_Tracking__c', records)
+            logger.info(f"Flushed {sum(results)} of {len(records)} queued tracking records")
+    
+    def _tracking_record_fields(self, shipment_id: str, event_data: Dict[str, Any],
+                                now_iso: str = None) -> Dict[str, Any]:
+        """TFST_Tracking__c field values for a tracking event"""
+        now_iso = now_iso or utc_now_iso()
+        status = event_data.get('status')
+        tracking_data = {
+            'TFST_Shipment__c': shipment_id,
+            'TFST_Tracking_Event__c': status if 'status' in event_data else 'Update',
+            'TFST_Current_Status__c': status,
+            'Time_of_Event__c': event_data.get('timestamp', now_iso),
+            'TFST_Coordinates__c': format_coordinates(event_data.get('location') or {}),
+            'TFST_Last_Update_Time__c': now_iso,
+            'TFST_Event_Source__c': TRACKING_EVENT_SOURCE
+        }
+        
+        if 'notes' in event_data:
+            tracking_data['TFST_Route_Details__c'] = event_data['notes']
+        
+        return tracking_data
+    
     def get_carrier_performance_metrics(self, carrier_id: str, days: int = 30) -> Dict[str, Any]:
         """
         Get carrier performance metrics for analytics
         """
         try:
-            # Calculate date range
-            start_date = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
-            safe_carrier_id = escape_soql(carrier_id)
-            
-            # Query for completed shipments
-            query = f"""
-                SELECT COUNT() total_shipments,
-                       COUNT_DISTINCT(Id) delivered_shipments
-                FROM TFST_Shipment__c
-                WHERE TFST_Carrier__c = '{safe_carrier_id}'
-                   AND CreatedDate >= {start_date}
-            """
-            
             # This would need to be enhanced with more complex SOQL queries
             # for detailed analytics like on-time delivery percentage
-            result = self.sf.query(query)
+            result = self._call(lambda: self.sf.query(self._carrier_performance_soql(carrier_id, days)))
+            
+            return self._performance_metrics(result, carrier_id, days)
+            
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get carrier performance for {carrier_id}")
+            return {}
+    
+    def get_carrier_performance_by_period(self, carrier_id: str, periods: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Get carrier performance metrics for several periods in one Salesforce round trip
+        """
+        try:
+            results = self.batch_query([self._carrier_performance_soql(carrier_id, days) for days in periods])
             
             return {
-                'total_shipments': result.get('totalSize', 0),
-                'period_days': days,
-                'carrier_id': carrier_id
+                days: self._performance_metrics(result, carrier_id, days) if result is not None else {}
+                for days, result in zip(periods, results)
             }
             
-        except Exception as e:
-            logger.error(f"Failed to get carrier performance for {carrier_id}: {str(e)}")
-            return {}
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get carrier performance for {carrier_id}")
+            return {days: {} for days in periods}
+    
+    def get_shipment_with_stages(self, shipment_id: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Get shipment details and its stages in one Salesforce round trip
+        Stages are matched through a semi-join on the same Id/Name filter
+        """
+        cached = self._shipment_cache.get(shipment_id)
+        if cached is not None:
+            cached_stages = self._stages_cache.get(cached['Id'])
+            if cached_stages is not None:
+                return cached, cached_stages
+        
+        try:
+            shipment_result, stages_result = self.batch_query([
+                self._shipment_details_soql(shipment_id),
+                self._shipment_stages_soql(
+                    f"IN (SELECT Id FROM TFST_Shipment__c WHERE {self._shipment_match(shipment_id)})"
+                )
+            ])
+            
+            shipment = shipment_result['records'][0] if shipment_result and shipment_result['totalSize'] > 0 else None
+            stages = stages_result['records'] if stages_result and shipment else []
+            
+            if shipment:
+                self._cache_shipment(shipment)
+                if stages_result:
+                    self._stages_cache.set(shipment['Id'], stages)
+            return shipment, stages
+            
+        except SALESFORCE_ERRORS:
+            logger.exception(f"Failed to get shipment with stages for {shipment_id}")
+            return None, []
+    
+    def batch_query(self, soqls: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Run several independent SOQL queries through the Composite Batch API
+        Returns each query result in order, or None where that subrequest failed
+        """
+        self._initialize_connection()
+        
+        results = []
+        for start in range(0, len(soqls), COMPOSITE_BATCH_LIMIT):
+            chunk = soqls[start:start + COMPOSITE_BATCH_LIMIT]
+            payload = {
+                'batchRequests': [
+                    # Collapse whitespace so multi-line SOQL stays short in the URL
+                    {'method': 'GET', 'url': f"v{self.sf.sf_version}/query/?q={quote(' '.join(soql.split()))}"}
+                    for soql in chunk
+                ]
+            }
+            
+            # Batched queries are read-only, so the POST can be retried like a GET
+            response = retry_transient(
+                lambda: self._rest('POST', 'composite/batch', payload=payload)
+            )
+            
+            for subresult in response['results']:
+                if subresult['statusCode'] == 200:
+                    results.append(subresult['result'])
+                else:
+                    logger.error(f"Batched SOQL query failed ({subresult['statusCode']}): {subresult['result']}")
+                    results.append(None)
+        
+        return results
+    
+    def _rest(self, method: str, url: str, payload: Any = None, params: Dict[str, str] = None,
+              headers: Dict[str, str] = None) -> Any:
+        """
+        Authenticated REST call on the pooled session, bypassing simple_salesforce's
+        stdlib JSON handling for large query and composite payloads
+        `url` is absolute or a path under the REST base URL, e.g. 'composite'
+        """
+        body = json_dumps(payload) if payload is not None else None
+        
+        def send():
+            # Resolved inside the guarded call: a missing connection surfaces as
+            # SalesforceServiceError, and a renewed session's instance is used
+            target = url if url.startswith('https://') else f"{self.sf.base_url}{url}"
+            response = self._session.request(
+                method, target,
+                headers={**self.sf.headers, **(headers or {})},
+                params=params,
+                data=body
+            )
+            response.raise_for_status()
+            return json_loads(response.content)
+        
+        return self._call(send)
 
 # Singleton instance
 salesforce_service = TFST_SalesforceService()
\ No newline at end of file
@@ -5,15 +5,25 @@ Manages user data by interacting with Salesforce
 from typing import Dict, Optional, Any
 import logging
 from app.services.salesforce_service import salesforce_service
+from app.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Portal users by Salesforce user ID; Flask-Login loads the user on every
+# authenticated request, so keep a short-lived copy instead of asking Salesforce each time
+USER_CACHE_TTL = 60
+_users_by_sf_id = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL)
+
 class UserService:
     @staticmethod
     def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by Salesforce ID"""
-        # This will be implemented in salesforce_service
-        return salesforce_service.get_user_by_id(user_id)
+        user = _users_by_sf_id.get(user_id)
+        if user is None:
+            user = salesforce_service.get_user_by_id(user_id)
+            if user:
+                _users_by_sf_id.set(user_id, user)
+        return user
 
     @staticmethod
     def find_user_by_salesforce_id(salesforce_id: str) -> Optional[Dict[str, Any]]:
@@ -23,8 +33,12 @@ class UserService:
     @staticmethod
     def create_or_update_user(user_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create or update user in Salesforce"""
-        # This will be implemented in salesforce_service
-        return salesforce_service.create_or_update_user(user_data)
+        # Drop the cached copy first so a failed upsert can't leave stale data behind
+        _users_by_sf_id.invalidate(user_data.get('salesforce_user_id'))
+        user = salesforce_service.create_or_update_user(user_data)
+        if user:
+            _users_by_sf_id.set(user_data['salesforce_user_id'], user)
+        return user
 
 # Export singleton
 user_service = UserService()
\ No newline at end of file
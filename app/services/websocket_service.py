@@ -4,16 +4,74 @@ Integrates with existing mobile app Firebase data for real-time updates
 """
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import current_user
-from flask import session
+from flask import session, request
 import logging
-import json
+import queue
+import threading
+import time
+from functools import lru_cache
+from collections import OrderedDict
 from typing import Dict, Any
 from datetime import datetime, timezone
 
+# Encode Socket.IO packets with orjson when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+class _OrjsonCodec:
+    """Stand-in for the json module in Socket.IO packets, backed by orjson"""
+    
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # python-socketio passes stdlib options such as separators; orjson output is already compact
+        return orjson.dumps(obj).decode('utf-8')
+    
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize SocketIO
-socketio = SocketIO(cors_allowed_origins="*", logger=True, engineio_logger=True)
+socketio = SocketIO()
+
+# Firestore updates are emitted from a background worker rather than the listener
+# callback; updates to the same shipment within one interval are coalesced
+EMIT_QUEUE_SIZE = 2000
+EMIT_BATCH_INTERVAL = 0.25
+
+# Keep a carrier's listener this long (seconds) after its last socket disconnects,
+# so page navigations don't tear down and reopen the listen stream
+LISTENER_IDLE_TIMEOUT = 300
+LISTENER_REAP_INTERVAL = 60
+
+# Event timestamps are reformatted at most this often (seconds); emit storms share one string
+TIMESTAMP_RESOLUTION = 0.1
+_timestamp_cache = (0.0, '')
+
+def _event_timestamp() -> str:
+    """Current UTC time as an ISO string, cached for TIMESTAMP_RESOLUTION"""
+    global _timestamp_cache
+    now = time.time()
+    cached_at, value = _timestamp_cache
+    if now - cached_at >= TIMESTAMP_RESOLUTION:
+        value = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        _timestamp_cache = (now, value)
+    return value
+
+# Room names are built on every emit, join and leave; reuse the strings
+@lru_cache(maxsize=4096)
+def _carrier_room(carrier_id: str) -> str:
+    return f"carrier_{carrier_id}"
+
+@lru_cache(maxsize=4096)
+def _shipment_room(shipment_id: str) -> str:
+    return f"shipment_{shipment_id}"
+
+# Tracking document fields pushed to the portal; other writes (e.g. a bare last_updated bump) aren't broadcast
+BROADCAST_FIELDS = ('current_status', 'location', 'driver_info')
 
 class FirebaseListener:
     """
@@ -24,78 +82,215 @@ class FirebaseListener:
         self.firebase_service = firebase_service
         self.socketio = socketio_instance
         self.active_listeners = {}
+        # Makes the check-and-start in start/stop_carrier_listener atomic
+        self._listener_lock = threading.Lock()
+        
+        # Connected socket ids per carrier, so a carrier's listener can be stopped
+        # once its last user disconnects instead of running for the process lifetime
+        self.connections = {}  # carrier_id -> set of sids
+        self._carrier_by_sid = {}  # sid -> carrier_id
+        self._idle_since = {}  # carrier_id -> monotonic time its last socket left
+        self._starting = set()  # carrier_ids whose listener is being opened
+        self._lock = threading.Lock()
+        
+        self._emit_queue = queue.Queue(maxsize=EMIT_QUEUE_SIZE)
+        
+        # Last broadcast values per document, so only changed fields are sent
+        self._last_doc_state = {}  # carrier_id -> {document_id: {field: value}}
     
-    def start_carrier_listener(self, carrier_id: str):
-        """Start listening to Firebase changes for a specific carrier"""
-        if carrier_id in self.active_listeners:
-            return  # Already listening
+    def add_connection(self, carrier_id: str, sid: str):
+        """Track a connected socket and make sure its carrier is being listened to"""
+        with self._lock:
+            self.connections.setdefault(carrier_id, set()).add(sid)
+            self._carrier_by_sid[sid] = carrier_id
+            self._idle_since.pop(carrier_id, None)
+            if carrier_id in self.active_listeners or carrier_id in self._starting:
+                return
+            self._starting.add(carrier_id)
         
+        # Opening the listen stream can take a while; keep it off the connect handshake
+        self.socketio.start_background_task(self._open_listener, carrier_id)
+    
+    def _open_listener(self, carrier_id: str):
+        """Background task starting a carrier's listener"""
         try:
-            # Create Firebase real-time listener
-            from firebase_admin import firestore
-            
-            db = firestore.client()
-            
-            # Listen to shipment_tracking changes for this carrier
-            query = db.collection('shipment_tracking').where('carrier_id', '==', carrier_id)
+            self.start_carrier_listener(carrier_id)
+        finally:
+            with self._lock:
+                self._starting.discard(carrier_id)
+                # Everyone may have left while it was opening
+                if carrier_id not in self.connections:
+                    self._idle_since.setdefault(carrier_id, time.monotonic())
+    
+    def remove_connection(self, sid: str):
+        """Forget a disconnected socket, marking its carrier idle if it was the last one"""
+        with self._lock:
+            carrier_id = self._carrier_by_sid.pop(sid, None)
+            if carrier_id is None:
+                return
             
-            def on_snapshot(docs, changes, read_time):
-                """Handle Firebase document changes"""
-                for change in changes:
-                    if change.type.name in ['ADDED', 'MODIFIED']:
-                        doc_data = change.document.to_dict()
-                        doc_data['document_id'] = change.document.id
-                        
-                        # Broadcast to carrier room
-                        self.broadcast_shipment_update(carrier_id, doc_data)
+            sids = self.connections.get(carrier_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.connections[carrier_id]
+                    self._idle_since[carrier_id] = time.monotonic()
+    
+    def run_listener_reaper(self):
+        """Stop listeners whose carrier has had no connected sockets for LISTENER_IDLE_TIMEOUT"""
+        while True:
+            self.socketio.sleep(LISTENER_REAP_INTERVAL)
             
-            # Start the listener
-            listener = query.on_snapshot(on_snapshot)
-            self.active_listeners[carrier_id] = listener
+            cutoff = time.monotonic() - LISTENER_IDLE_TIMEOUT
+            detached = []
+            with self._lock:
+                idle = [carrier_id for carrier_id, since in self._idle_since.items() if since <= cutoff]
+                for carrier_id in idle:
+                    del self._idle_since[carrier_id]
+                    callback = self._detach_listener(carrier_id)
+                    if callback is not None:
+                        detached.append((carrier_id, callback))
             
-            logger.info(f"Started Firebase listener for carrier {carrier_id}")
+            # Closing a listen stream can block, so it happens outside the lock. Listeners are
+            # detached above, so a carrier reconnecting meanwhile opens a fresh one
+            for carrier_id, callback in detached:
+                self._unsubscribe(carrier_id, callback)
+    
+    def connected_count(self, carrier_id: str = None) -> int:
+        """Number of sockets connected for a carrier, or across all carriers"""
+        if carrier_id is None:
+            return len(self._carrier_by_sid)
+        return len(self.connections.get(carrier_id, ()))
+    
+    def start_carrier_listener(self, carrier_id: str):
+        """Start listening to Firebase changes for a specific carrier"""
+        def on_update(doc_data):
+            """Handle Firebase document changes"""
+            # Broadcast to carrier room
+            self.broadcast_shipment_update(carrier_id, doc_data)
+        
+        with self._listener_lock:
+            if carrier_id in self.active_listeners:
+                return  # Already listening
             
-        except Exception as e:
-            logger.error(f"Failed to start Firebase listener for carrier {carrier_id}: {str(e)}")
+            # Shares the Firebase service's listen stream for this carrier
+            if self.firebase_service.create_realtime_listener(carrier_id, on_update):
+                self.active_listeners[carrier_id] = on_update
+                logger.info("Started Firebase listener for carrier %s", carrier_id)
+            else:
+                logger.error("Failed to start Firebase listener for carrier %s", carrier_id)
     
     def stop_carrier_listener(self, carrier_id: str):
         """Stop listening to Firebase changes for a carrier"""
-        if carrier_id in self.active_listeners:
-            listener = self.active_listeners[carrier_id]
-            listener.unsubscribe()
-            del self.active_listeners[carrier_id]
-            logger.info(f"Stopped Firebase listener for carrier {carrier_id}")
+        callback = self._detach_listener(carrier_id)
+        if callback is not None:
+            self._unsubscribe(carrier_id, callback)
+    
+    def _detach_listener(self, carrier_id: str):
+        """Forget a carrier's listener so a new one can start; returns its callback, or None"""
+        with self._listener_lock:
+            self._last_doc_state.pop(carrier_id, None)
+            return self.active_listeners.pop(carrier_id, None)
+    
+    def _unsubscribe(self, carrier_id: str, callback):
+        """Remove a detached listener's callback from the Firebase service"""
+        self.firebase_service.remove_realtime_listener(carrier_id, callback)
+        logger.info("Stopped Firebase listener for carrier %s", carrier_id)
+    
+    def _queue_emit(self, event: str, data: Dict[str, Any], room: str):
+        """Hand an emit to the background worker, dropping the oldest one if it has fallen behind"""
+        try:
+            self._emit_queue.put_nowait((event, data, room))
+        except queue.Full:
+            try:
+                self._emit_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._emit_queue.put_nowait((event, data, room))
+    
+    def run_emit_worker(self):
+        """
+        Drain queued emits every EMIT_BATCH_INTERVAL, sending only the latest
+        update per shipment so a Firestore batch write doesn't become a burst of frames
+        """
+        while True:
+            self.socketio.sleep(EMIT_BATCH_INTERVAL)
+            
+            pending = OrderedDict()
+            while True:
+                try:
+                    event, data, room = self._emit_queue.get_nowait()
+                except queue.Empty:
+                    break
+                key = (event, room, data.get('shipment_id'))
+                previous = pending.pop(key, None)
+                if previous:
+                    # Updates carry only changed fields, so fold them together
+                    data = {**previous[1], **data}
+                pending[key] = (event, data, room)
+            
+            for event, data, room in pending.values():
+                try:
+                    # Every worker with clients for this carrier runs its own listener,
+                    # so deliver locally rather than through the message queue
+                    self.socketio.emit(event, data, room=room, ignore_queue=True)
+                except Exception as e:
+                    # Keep draining: one bad emit must not stop every later broadcast
+                    logger.error("Failed to emit %s to %s: %s", event, room, e)
     
     def broadcast_shipment_update(self, carrier_id: str, shipment_data: Dict[str, Any]):
-        """Broadcast shipment update to all connected carrier users"""
+        """
+        Broadcast shipment update to all connected carrier users
+        Only fields that changed since the last broadcast are sent; shipment_id and
+        current_status are always included since clients key and label updates by them
+        """
         try:
-            # Format data for web portal
-            update_data = {
-                'shipment_id': shipment_data.get('shipment_id'),
-                'current_status': shipment_data.get('current_status'),
-                'location': shipment_data.get('location'),
-                'driver_info': shipment_data.get('driver_info'),
-                'last_updated': shipment_data.get('last_updated'),
-                'timestamp': datetime.now(timezone.utc).isoformat(),
-                'source': 'mobile_app'
-            }
+            state = self._last_doc_state.setdefault(carrier_id, {})
+            doc_id = shipment_data.get('document_id') or shipment_data.get('shipment_id')
+            previous = state.get(doc_id, {})
+            current = {field: shipment_data.get(field) for field in BROADCAST_FIELDS}
+            changed = {field for field, value in current.items() if field not in previous or previous[field] != value}
+            state[doc_id] = current
+            
+            if not changed:
+                return
+            
+            location = current['location'] if 'location' in changed else None
             
-            # Emit to carrier room
-            self.socketio.emit('shipment_update', update_data, room=f"carrier_{carrier_id}")
+            timestamp = _event_timestamp()
+            
+            # Status and driver changes go out as shipment updates carrying any new
+            # location in the same frame; location-only changes just move the map marker
+            if 'current_status' in changed or 'driver_info' in changed:
+                update_data = {
+                    'shipment_id': shipment_data.get('shipment_id'),
+                    'current_status': current['current_status'],
+                    'last_updated': shipment_data.get('last_updated'),
+                    'timestamp': timestamp,
+                    'source': 'mobile_app'
+                }
+                if 'driver_info' in changed:
+                    update_data['driver_info'] = current['driver_info']
+                if location:
+                    update_data['location'] = location
+                
+                # Emit to carrier room
+                self._queue_emit('shipment_update', update_data, room=_carrier_room(carrier_id))
             
             # Emit specific location update for map
-            if shipment_data.get('location'):
+            elif location:
                 location_data = {
                     'shipment_id': shipment_data.get('shipment_id'),
-                    'location': shipment_data.get('location'),
-                    'timestamp': update_data['timestamp']
+                    'location': location,
+                    'timestamp': timestamp
                 }
-                self.socketio.emit('location_update', location_data, room=f"carrier_{carrier_id}")
+                self._queue_emit('location_update', location_data, room=_carrier_room(carrier_id))
             
-            logger.info(f"Broadcasted update for shipment {shipment_data.get('shipment_id')} to carrier {carrier_id}")
+            logger.debug("Queued update for shipment %s to carrier %s", shipment_data.get('shipment_id'), carrier_id)
             
-        except Exception as e:
-            logger.error(f"Failed to broadcast shipment update: {str(e)}")
+        except (AttributeError, TypeError, ValueError) as e:
+            # Malformed tracking document from the mobile app
+            logger.error("Failed to broadcast shipment update: %s", e)
 
 # Global Firebase listener instance
 firebase_listener = None
@@ -104,8 +299,22 @@ def init_websocket(app, firebase_service):
     """Initialize WebSocket with app and Firebase service"""
     global firebase_listener
     
-    socketio.init_app(app, async_mode='threading', cors_allowed_origins="*")
+    # Green-thread servers multiplex sockets far more cheaply than one OS thread each;
+    # with a message queue, broadcasts from any worker reach every worker's clients
+    options = {'json': _OrjsonCodec} if orjson else {}
+    socketio.init_app(
+        app,
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+        message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+        cors_allowed_origins=app.config.get('SOCKETIO_CORS_ALLOWED_ORIGINS'),
+        logger=app.config.get('SOCKETIO_DEBUG', False),
+        engineio_logger=app.config.get('SOCKETIO_DEBUG', False),
+        **options
+    )
     firebase_listener = FirebaseListener(firebase_service, socketio)
+    socketio.start_background_task(firebase_listener.run_emit_worker)
+    socketio.start_background_task(firebase_listener.run_listener_reaper)
+    socketio.start_background_task(firebase_service.run_history_trimmer, socketio.sleep)
     
     return socketio
 
@@ -118,44 +327,46 @@ def handle_connect():
             
             if carrier_id:
                 # Join carrier-specific room
-                join_room(f"carrier_{carrier_id}")
+                join_room(_carrier_room(carrier_id))
                 
                 # Start Firebase listener for this carrier if not already active
                 if firebase_listener:
-                    firebase_listener.start_carrier_listener(carrier_id)
+                    firebase_listener.add_connection(carrier_id, request.sid)
                 
                 emit('connected', {
                     'status': 'success',
                     'user_id': current_user.id,
                     'carrier_id': carrier_id,
-                    'timestamp': datetime.now(timezone.utc).isoformat()
+                    'timestamp': _event_timestamp()
                 })
                 
-                logger.info(f"User {current_user.id} (Carrier: {carrier_id}) connected to WebSocket")
+                logger.info("User %s (Carrier: %s) connected to WebSocket", current_user.id, carrier_id)
             else:
                 emit('connected', {'status': 'error', 'message': 'No carrier ID found'})
         else:
             emit('connected', {'status': 'error', 'message': 'Not authenticated'})
             
     except Exception as e:
-        logger.error(f"WebSocket connection error: {str(e)}")
+        logger.error("WebSocket connection error: %s", e)
         emit('connected', {'status': 'error', 'message': 'Connection failed'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     try:
+        # The listener is stopped later, once no user from the same carrier has been connected for a while
+        if firebase_listener:
+            firebase_listener.remove_connection(request.sid)
+        
         if current_user.is_authenticated:
             carrier_id = session.get('carrier_id')
             
             if carrier_id:
-                leave_room(f"carrier_{carrier_id}")
-                logger.info(f"User {current_user.id} (Carrier: {carrier_id}) disconnected from WebSocket")
-            
-            # Note: We don't stop the Firebase listener here as other users from the same carrier might be connected
+                leave_room(_carrier_room(carrier_id))
+                logger.info("User %s (Carrier: %s) disconnected from WebSocket", current_user.id, carrier_id)
             
     except Exception as e:
-        logger.error(f"WebSocket disconnection error: {str(e)}")
+        logger.error("WebSocket disconnection error: %s", e)
 
 @socketio.on('subscribe_shipment')
 def handle_subscribe_shipment(data):
@@ -173,17 +384,17 @@ def handle_subscribe_shipment(data):
             return
         
         # Join shipment-specific room
-        join_room(f"shipment_{shipment_id}")
+        join_room(_shipment_room(shipment_id))
         
         emit('subscribed', {
             'shipment_id': shipment_id,
             'status': 'success'
         })
         
-        logger.info(f"User {current_user.id} subscribed to shipment {shipment_id}")
+        logger.info("User %s subscribed to shipment %s", current_user.id, shipment_id)
         
     except Exception as e:
-        logger.error(f"Shipment subscription error: {str(e)}")
+        logger.error("Shipment subscription error: %s", e)
         emit('error', {'message': 'Subscription failed'})
 
 @socketio.on('unsubscribe_shipment')
@@ -193,12 +404,13 @@ def handle_unsubscribe_shipment(data):
         shipment_id = data.get('shipment_id')
         
         if shipment_id:
-            leave_room(f"shipment_{shipment_id}")
+            leave_room(_shipment_room(shipment_id))
             emit('unsubscribed', {'shipment_id': shipment_id})
-            logger.info(f"User {current_user.id if current_user.is_authenticated else 'Anonymous'} unsubscribed from shipment {shipment_id}")
+            logger.info("User %s unsubscribed from shipment %s",
+                        current_user.id if current_user.is_authenticated else 'Anonymous', shipment_id)
         
     except Exception as e:
-        logger.error(f"Shipment unsubscription error: {str(e)}")
+        logger.error("Shipment unsubscription error: %s", e)
 
 @socketio.on('ping')
 def handle_ping():
@@ -228,7 +440,7 @@ def handle_request_status(data):
                 emit('shipment_status', {
                     'shipment_id': shipment_id,
                     'data': tracking_data,
-                    'timestamp': datetime.now(timezone.utc).isoformat()
+                    'timestamp': _event_timestamp()
                 })
             else:
                 emit('shipment_status', {
@@ -240,44 +452,36 @@ def handle_request_status(data):
             emit('error', {'message': 'Firebase service not available'})
             
     except Exception as e:
-        logger.error(f"Status request error: {str(e)}")
+        logger.error("Status request error: %s", e)
         emit('error', {'message': 'Status request failed'})
 
 # Utility functions for manual broadcasting (used by routes)
 def broadcast_to_carrier(carrier_id: str, event: str, data: Dict[str, Any]):
     """Broadcast event to all users of a specific carrier"""
-    socketio.emit(event, data, room=f"carrier_{carrier_id}")
+    socketio.emit(event, data, room=_carrier_room(carrier_id))
 
 def broadcast_to_shipment(shipment_id: str, event: str, data: Dict[str, Any]):
     """Broadcast event to all users subscribed to a specific shipment"""
-    socketio.emit(event, data, room=f"shipment_{shipment_id}")
+    socketio.emit(event, data, room=_shipment_room(shipment_id))
 
 def broadcast_status_update(carrier_id: str, shipment_id: str, status_data: Dict[str, Any]):
     """Broadcast status update to carrier and shipment rooms"""
     update_data = {
         'shipment_id': shipment_id,
         'status_data': status_data,
-        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'timestamp': _event_timestamp(),
         'source': 'web_portal'
     }
     
-    # Broadcast to carrier room
-    socketio.emit('shipment_update', update_data, room=f"carrier_{carrier_id}")
-    
-    # Broadcast to shipment-specific room
-    socketio.emit('shipment_update', update_data, room=f"shipment_{shipment_id}")
+    # One emit to carrier and shipment rooms; sockets in both receive it once
+    socketio.emit('shipment_update', update_data, to=[_carrier_room(carrier_id), _shipment_room(shipment_id)])
 
 def get_connected_users_count(carrier_id: str = None) -> int:
     """Get count of connected users for a carrier or total"""
-    try:
-        if carrier_id:
-            room_name = f"carrier_{carrier_id}"
-            # This is a simplified count - in production you'd need to track this properly
-            return len(socketio.server.manager.get_participants(socketio.server.eio.namespace, room_name))
-        else:
-            return len(socketio.server.manager.get_participants(socketio.server.eio.namespace, '/'))
-    except:
+    # Counted from the connect/disconnect index rather than walking the Socket.IO manager
+    if not firebase_listener:
         return 0
+    return firebase_listener.connected_count(carrier_id or None)
 
 # Integration with existing mobile app Firebase data
 class MobileAppIntegration:
@@ -290,7 +494,9 @@ class MobileAppIntegration:
         """
         Sync mobile app updates to web portal users
         This would be called when mobile app writes to Firebase
+        Sends one frame per carrier: a single update as 'mobile_update', several as 'mobile_update_batch'
         """
+        by_carrier = {}
         for update in shipment_updates:
             carrier_id = update.get('carrier_id')
             shipment_id = update.get('shipment_id')
@@ -305,8 +511,13 @@ class MobileAppIntegration:
                     'timestamp': update.get('timestamp'),
                     'source': 'mobile_app'
                 }
-                
-                broadcast_to_carrier(carrier_id, 'mobile_update', portal_update)
+                by_carrier.setdefault(carrier_id, []).append(portal_update)
+        
+        for carrier_id, items in by_carrier.items():
+            if len(items) == 1:
+                broadcast_to_carrier(carrier_id, 'mobile_update', items[0])
+            else:
+                broadcast_to_carrier(carrier_id, 'mobile_update_batch', {'items': items, 'timestamp': _event_timestamp()})
     
     @staticmethod
     def handle_driver_status_change(driver_data: dict):
@@ -318,7 +529,7 @@ class MobileAppIntegration:
             'driver_name': driver_data.get('name'),
             'truck_number': driver_data.get('truck_number'),
             'status': driver_data.get('status'),  # online, offline, driving
-            'timestamp': datetime.now(timezone.utc).isoformat()
+            'timestamp': _event_timestamp()
         }
         
         broadcast_to_carrier(carrier_id, 'driver_status_change', driver_info)
@@ -337,14 +548,15 @@ class MobileAppIntegration:
             'shipment_id': shipment_id,
             'alert_message': alert_data.get('message'),
             'location': alert_data.get('location'),
-            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'timestamp': _event_timestamp(),
             'requires_immediate_attention': True
         }
         
-        # Broadcast to carrier and shipment rooms
-        broadcast_to_carrier(carrier_id, 'emergency_alert', emergency_data)
+        # Broadcast to carrier and shipment rooms in one emit
+        rooms = [_carrier_room(carrier_id)]
         if shipment_id:
-            broadcast_to_shipment(shipment_id, 'emergency_alert', emergency_data)
+            rooms.append(_shipment_room(shipment_id))
+        socketio.emit('emergency_alert', emergency_data, to=rooms)
 
 # Export main components
 __all__ = [
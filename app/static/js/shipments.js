@@ -150,6 +150,11 @@ class TFSTShipments {
             
             this.socket.on('shipment_update', (data) => {
                 this.handleRealtimeUpdate(data);
+                
+                // Status updates carry a changed location in the same event
+                if (data.location) {
+                    this.updateMapMarker(data.shipment_id, data.location);
+                }
             });
             
             this.socket.on('location_update', (data) => {
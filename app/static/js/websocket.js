@@ -76,6 +76,10 @@ class TFSTWebSocket {
         this.socket.on('mobile_update', (data) => {
             this.handleMobileUpdate(data);
         });
+        
+        this.socket.on('mobile_update_batch', (data) => {
+            data.items.forEach((item) => this.handleMobileUpdate(item));
+        });
     }
     
     updateConnectionStatus(status) {
@@ -108,6 +112,11 @@ class TFSTWebSocket {
         // Update any visible shipment displays
         this.updateShipmentDisplay(data);
         
+        // Status updates carry a changed location in the same event
+        if (data.location) {
+            this.handleLocationUpdate(data);
+        }
+        
         // Show notification
         this.showNotification(`Shipment ${data.shipment_id} updated: ${data.current_status}`, 'info');
     }
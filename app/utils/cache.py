@@ -0,0 +1,145 @@
+"""
+TFST Carrier Portal - In-Process Caching
+Small thread-safe TTL caches for hot read paths
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a fixed TTL
+    Safe to share between request threads
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Drop a single entry if present"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SharedTTLCache(TTLCache):
+    """
+    TTLCache backed by a shared Redis store so all workers reuse each other's entries
+    Falls back to the local cache alone when no store is available or Redis errors
+    With local=False the in-process layer is skipped while the store is available, so an
+    invalidation takes effect in every worker at once; use it for records that get edited
+    """
+
+    def __init__(self, prefix: str, store: Callable[[], Optional[Any]], maxsize: int = 1024,
+                 ttl: float = 300, dumps: Callable[[Any], Any] = json.dumps,
+                 loads: Callable[[Any], Any] = json.loads, local: bool = True):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.prefix = prefix
+        self.local = local
+        self._store = store
+        self._dumps = dumps
+        self._loads = loads
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the local entry, else the shared one (copied locally), else default"""
+        if self.local:
+            value = super().get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+        store = self._store()
+        if store is None:
+            # Without a shared store the local layer is all there is
+            return default if self.local else super().get(key, default)
+
+        try:
+            raw = store.get(f"{self.prefix}{key}")
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache read failed for {self.prefix}{key}: {str(e)}")
+            return default
+
+        if raw is None:
+            return default
+
+        # A corrupt or incompatible entry is a miss; the next set overwrites it
+        try:
+            value = self._loads(raw)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Shared cache entry {self.prefix}{key} could not be decoded: {str(e)}")
+            return default
+
+        if self.local:
+            super().set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store value locally and in the shared store"""
+        store = self._store()
+        if self.local or store is None:
+            super().set(key, value)
+
+        if store is None:
+            return
+
+        try:
+            store.set(f"{self.prefix}{key}", self._dumps(value), ex=int(self.ttl))
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache write failed for {self.prefix}{key}: {str(e)}")
+
+    def invalidate(self, key: Hashable):
+        """Drop an entry locally and from the shared store"""
+        super().invalidate(key)
+
+        store = self._store()
+        if store is None:
+            return
+
+        try:
+            store.delete(f"{self.prefix}{key}")
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache delete failed for {self.prefix}{key}: {str(e)}")
@@ -1,9 +1,3 @@
- app/utils/__init__.py
-"""
-TFST Carrier Portal - Utility Package
-"""
-
-# app/utils/decorators.py
 """
 TFST Carrier Portal - Custom Decorators
 """
@@ -11,13 +5,17 @@ from functools import wraps
 from flask import session, redirect, url_for, request, jsonify, flash
 from flask_login import current_user
 import logging
-from app.services.salesforce_service import salesforce_service
-from datetime import datetime, timedelta
+import time
+from typing import Optional, Tuple
+from app.services.salesforce_service import salesforce_service, TOKEN_REFRESH_MARGIN
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
 def require_permissions(*permissions):
     """Decorator to require specific user permissions"""
+    required = frozenset(permissions)
+    
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -26,16 +24,53 @@ def require_permissions(*permissions):
                     return jsonify({'error': 'Authentication required'}), 401
                 return redirect(url_for('auth.login'))
             
-            for permission in permissions:
-                if not current_user.has_permission(permission):
-                    if request.is_json:
-                        return jsonify({'error': f'Permission {permission} required'}), 403
-                    return redirect(url_for('dashboard.index'))
+            missing = required - current_user.get_permission_set()
+            if missing:
+                if request.is_json:
+                    # Name the first missing permission in declaration order
+                    permission = next(p for p in permissions if p in missing)
+                    return jsonify({'error': f'Permission {permission} required'}), 403
+                return redirect(url_for('dashboard.index'))
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def ensure_fresh_token(session) -> Optional[Tuple[str, str]]:
+    """
+    Refresh the Salesforce access token shortly before it expires, so downstream
+    calls don't fail with a 401 first
+    Returns a (message, category) flash for the user if the session can't be kept alive, else None
+    """
+    # The expiry is kept as an epoch number so this per-request check is a plain comparison
+    expires_ts = session.get('sf_access_token_expires_ts')
+    if expires_ts is None and session.get('sf_access_token_expires_at'):
+        # Sessions created before the epoch field: convert the ISO string once
+        expires_at = datetime.fromisoformat(session.pop('sf_access_token_expires_at'))
+        expires_ts = session['sf_access_token_expires_ts'] = expires_at.replace(tzinfo=timezone.utc).timestamp()
+
+    now = time.time()
+    if not expires_ts or expires_ts - now > TOKEN_REFRESH_MARGIN:
+        return None
+
+    if 'sf_refresh_token' not in session:
+        if now < expires_ts:
+            return None
+        return 'Your session has expired. Please log in again.', 'warning'
+
+    try:
+        token = salesforce_service.refresh_access_token_shared(session['sf_refresh_token'])
+    except Exception as e:
+        logger.error(f"Failed to refresh Salesforce token: {str(e)}")
+        # Still inside the margin: keep using the current token for now
+        if now < expires_ts:
+            return None
+        return 'Your session could not be refreshed. Please log in again.', 'error'
+
+    session['sf_access_token'] = token['access_token']
+    session['sf_access_token_expires_ts'] = token['expires_ts']
+    return None
+
 def salesforce_token_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -43,23 +78,10 @@ def salesforce_token_required(f):
             flash('Please log in to access this page.', 'warning')
             return redirect(url_for('auth.login'))
 
-        # Check if the access token is expired
-        expires_at = session.get('sf_access_token_expires_at')
-        if expires_at and datetime.utcnow() >= datetime.fromisoformat(expires_at):
-            if 'sf_refresh_token' not in session:
-                flash('Your session has expired. Please log in again.', 'warning')
-                return redirect(url_for('auth.logout'))
-
-            try:
-                # Refresh the token
-                new_token_response = salesforce_service.refresh_access_token(session['sf_refresh_token'])
-                session['sf_access_token'] = new_token_response['access_token']
-                # Salesforce tokens typically last for 2 hours
-                session['sf_access_token_expires_at'] = (datetime.utcnow() + timedelta(hours=2)).isoformat()
-            except Exception as e:
-                logger.error(f"Failed to refresh Salesforce token: {str(e)}")
-                flash('Your session could not be refreshed. Please log in again.', 'error')
-                return redirect(url_for('auth.logout'))
+        failure = ensure_fresh_token(session)
+        if failure:
+            flash(*failure)
+            return redirect(url_for('auth.logout'))
 
         return f(*args, **kwargs)
     return decorated_function
@@ -86,20 +108,25 @@ def api_response(f):
         try:
             result = f(*args, **kwargs)
             
-            # If result is already a response, return it
-            if hasattr(result, 'status_code'):
-                return result
+            # Plain data is the common case; check it before probing for a response
+            result_type = type(result)
+            if result_type is dict or result_type is list:
+                return jsonify(result)
             
             # If result is a tuple (data, status_code)
             if isinstance(result, tuple):
                 data, status_code = result
                 return jsonify(data), status_code
             
+            # If result is already a response, return it
+            if hasattr(result, 'status_code'):
+                return result
+            
             # If result is just data
             return jsonify(result)
             
         except Exception as e:
-            logger.error(f"API endpoint error: {str(e)}")
+            logger.error("API endpoint error: %s", e)
             return jsonify({
                 'success': False,
                 'error': 'Internal server error'
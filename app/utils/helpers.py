@@ -2,20 +2,70 @@
 TFST Carrier Portal - Helper Utilities
 Common utility functions for file handling, validation, etc.
 """
+import functools
 import os
-import uuid
+import re
+import secrets
 from werkzeug.utils import secure_filename
 from flask import current_app
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Set
 import logging
+from math import asin, cos, radians, sin, sqrt
+from datetime import date, datetime, timezone
+import dateutil.parser as date_parser
 
 logger = logging.getLogger(__name__)
 
-def allowed_file(filename: str) -> bool:
-    """Check if file extension is allowed"""
-    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'pdf', 'csv'})
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in allowed_extensions
+DEFAULT_ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'pdf', 'csv'})
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB")
+
+# \Z rather than $ so a trailing newline doesn't pass
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z')
+
+# Strips everything but ASCII digits from phone numbers
+_strip_non_digits = functools.partial(re.compile(r'[^0-9]+').sub, '')
+
+# Placeholder values carriers put in timestamp columns; never worth handing to dateutil
+_NULLISH_TIMESTAMPS = frozenset({'', 'n/a', 'na', 'null', 'none', '-', 'unknown', 'tbd'})
+
+# Service levels that always make a shipment high priority, including composite
+# labels such as "Critical Hot Shot"
+_URGENT_SERVICE_RE = re.compile(r'urgent|critical')
+
+# Carrier CSV timestamp formats tried with strptime before falling back to dateutil
+_FAST_TIMESTAMP_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y'
+)
+
+# Shipment status colors, looked up per row when rendering
+STATUS_COLORS = {
+    'Dispatched': '#FFA500',           # Orange
+    'At pickup site': '#FFD700',       # Gold
+    'Pickup Complete': '#32CD32',       # Lime Green
+    'In Transit': '#1E90FF',           # Dodger Blue
+    'Delayed': '#FF4500',              # Red Orange
+    'Arrived at site': '#9370DB',      # Medium Purple
+    'Delivered': '#228B22',            # Forest Green
+    'Unloading complete': '#008000'    # Green
+}
+DEFAULT_STATUS_COLOR = '#708090'  # Slate Gray
+
+def allowed_file(filename: str, allowed_extensions: Optional[Set[str]] = None) -> bool:
+    """Check if file extension is allowed; defaults to the app's ALLOWED_EXTENSIONS"""
+    if allowed_extensions is None:
+        allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', DEFAULT_ALLOWED_EXTENSIONS)
+    _, dot, extension = filename.rpartition('.')
+    if not dot:
+        return False
+    
+    # Extensions are nearly always lowercase already; only lower them on a miss
+    return extension in allowed_extensions or extension.lower() in allowed_extensions
 
 def validate_file_upload(file) -> Dict[str, Any]:
     """Validate file upload requirements"""
@@ -24,12 +74,18 @@ def validate_file_upload(file) -> Dict[str, Any]:
         if not file.filename:
             return {'valid': False, 'error': 'No filename provided'}
         
+        # Resolve the config proxy once for both checks
+        config = current_app.config
+        
         # Check file extension
-        if not allowed_file(file.filename):
+        if not allowed_file(file.filename, config.get('ALLOWED_EXTENSIONS', DEFAULT_ALLOWED_EXTENSIONS)):
             return {'valid': False, 'error': 'File type not allowed'}
         
         # Check file size (16MB limit)
-        max_size = current_app.config.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)
+        # Measure the stream itself; a client-declared length can't be trusted here.
+        # Seeking to the end is an lseek for spooled files (fileno()/fstat would
+        # force them onto disk)
+        max_size = config.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)
         file.seek(0, os.SEEK_END)
         file_size = file.tell()
         file.seek(0)  # Reset file pointer
@@ -46,49 +102,61 @@ def validate_file_upload(file) -> Dict[str, Any]:
         logger.error(f"File validation error: {str(e)}")
         return {'valid': False, 'error': 'File validation failed'}
 
+def sniff_csv(file, sample_size: int = 4096) -> bool:
+    """Check that an uploaded file looks like CSV text without consuming the stream"""
+    try:
+        sample = file.stream.read(sample_size)
+        file.stream.seek(0)  # Reset stream for the upload
+        
+        # Binary files (spreadsheets, images, archives) contain NUL bytes
+        if not sample or b'\x00' in sample:
+            return False
+        
+        # Header row must be comma separated
+        header = sample.split(b'\n', 1)[0]
+        return b',' in header
+        
+    except Exception as e:
+        logger.error(f"CSV sniff error: {str(e)}")
+        return False
+
 def generate_unique_filename(original_filename: str) -> str:
     """Generate unique filename while preserving extension"""
     try:
         secure_name = secure_filename(original_filename)
         name, ext = os.path.splitext(secure_name)
-        unique_name = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
+        unique_name = f"{name}_{secrets.token_hex(4)}{ext}"
         return unique_name
     except Exception as e:
         logger.error(f"Error generating unique filename: {str(e)}")
-        return f"file_{uuid.uuid4().hex[:8]}.txt"
+        return f"file_{secrets.token_hex(4)}.txt"
 
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format"""
     if size_bytes == 0:
         return "0 B"
     
-    size_units = ["B", "KB", "MB", "GB"]
-    size = float(size_bytes)
-    unit_index = 0
+    # Fractional and negative sizes stay in bytes, as they always have
+    if size_bytes < 1024:
+        return f"{float(size_bytes):.1f} B"
     
-    while size >= 1024 and unit_index < len(size_units) - 1:
-        size /= 1024
-        unit_index += 1
-    
-    return f"{size:.1f} {size_units[unit_index]}"
+    # Every 10 bits is one 1024x unit step
+    unit_index = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (unit_index * 10)):.1f} {_SIZE_UNITS[unit_index]}"
 
 def validate_coordinates(lat: float, lng: float) -> bool:
     """Validate GPS coordinates"""
+    # JSON bodies already carry numbers; only strings and the like need converting
     try:
-        lat = float(lat)
-        lng = float(lng)
-        
-        # Check valid ranges
-        if not (-90 <= lat <= 90):
-            return False
-        
-        if not (-180 <= lng <= 180):
-            return False
-        
-        return True
-        
+        if not isinstance(lat, (int, float)):
+            lat = float(lat)
+        if not isinstance(lng, (int, float)):
+            lng = float(lng)
     except (ValueError, TypeError):
         return False
+    
+    # Check valid ranges
+    return -90 <= lat <= 90 and -180 <= lng <= 180
 
 def format_phone_number(phone: str) -> str:
     """Format phone number consistently"""
@@ -96,7 +164,7 @@ def format_phone_number(phone: str) -> str:
         return ""
     
     # Remove all non-numeric characters
-    digits = ''.join(filter(str.isdigit, phone))
+    digits = _strip_non_digits(phone)
     
     # Format based on length
     if len(digits) == 10:
@@ -114,29 +182,52 @@ def sanitize_input(input_string: str, max_length: int = None) -> str:
     # Strip whitespace
     sanitized = input_string.strip()
     
-    # Limit length if specified
-    if max_length and len(sanitized) > max_length:
-        sanitized = sanitized[:max_length]
+    # Limit length if specified; slicing past the end is already a no-op
+    return sanitized[:max_length] if max_length else sanitized
+
+def _parse_timestamp(value: str) -> datetime:
+    """ISO 8601 and known carrier formats first; dateutil's format guessing only as a last resort"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        pass
+    
+    for fmt in _FAST_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
     
-    return sanitized
+    return date_parser.parse(value)
+
+@functools.lru_cache(maxsize=4096)
+def _timestamp_to_iso(timestamp_str: str) -> str:
+    """
+    ISO form of a raw timestamp string; memoized since CSV rows repeat the same values
+    Raises on unparseable input (exceptions aren't cached)
+    """
+    parsed_date = _parse_timestamp(timestamp_str.strip())
+    
+    # Convert to UTC if no timezone info
+    if parsed_date.tzinfo is None:
+        parsed_date = parsed_date.replace(tzinfo=timezone.utc)
+    
+    return parsed_date.isoformat()
 
 def parse_csv_timestamp(timestamp_str: str) -> str:
     """Parse various timestamp formats to ISO format"""
-    from datetime import datetime, timezone
-    import dateutil.parser as date_parser
-    
+    # Empty and invalid values fall back to the current time, so they stay out of the cache.
+    # dateutil can take seconds to reject garbage, so placeholders and digit-free
+    # strings are turned away before reaching it
     if not timestamp_str:
         return datetime.now(timezone.utc).isoformat()
     
+    stripped = timestamp_str.strip()
+    if stripped.lower() in _NULLISH_TIMESTAMPS or not any(c.isdigit() for c in stripped):
+        return datetime.now(timezone.utc).isoformat()
+    
     try:
-        # Try parsing with dateutil (handles many formats)
-        parsed_date = date_parser.parse(timestamp_str)
-        
-        # Convert to UTC if no timezone info
-        if parsed_date.tzinfo is None:
-            parsed_date = parsed_date.replace(tzinfo=timezone.utc)
-        
-        return parsed_date.isoformat()
+        return _timestamp_to_iso(timestamp_str)
         
     except Exception as e:
         logger.warning(f"Could not parse timestamp '{timestamp_str}': {str(e)}")
@@ -144,11 +235,9 @@ def parse_csv_timestamp(timestamp_str: str) -> str:
 
 def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
     """Calculate distance between two GPS coordinates in miles"""
-    from math import radians, cos, sin, asin, sqrt
-    
     try:
         # Convert to radians
-        lat1, lng1, lat2, lng2 = map(radians, [lat1, lng1, lat2, lng2])
+        lat1, lng1, lat2, lng2 = radians(lat1), radians(lng1), radians(lat2), radians(lng2)
         
         # Haversine formula
         dlat = lat2 - lat1
@@ -167,25 +256,21 @@ def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> fl
 
 def get_status_color(status: str) -> str:
     """Get color code for shipment status"""
-    status_colors = {
-        'Dispatched': '#FFA500',           # Orange
-        'At pickup site': '#FFD700',       # Gold
-        'Pickup Complete': '#32CD32',       # Lime Green
-        'In Transit': '#1E90FF',           # Dodger Blue
-        'Delayed': '#FF4500',              # Red Orange
-        'Arrived at site': '#9370DB',      # Medium Purple
-        'Delivered': '#228B22',            # Forest Green
-        'Unloading complete': '#008000'    # Green
-    }
-    
-    return status_colors.get(status, '#708090')  # Slate Gray as default
+    return STATUS_COLORS.get(status, DEFAULT_STATUS_COLOR)
+
+@functools.lru_cache(maxsize=256)
+def _is_urgent_service_level(service_level: str) -> bool:
+    """Service levels come from a small picklist, so each distinct label is scanned once"""
+    return _URGENT_SERVICE_RE.search(service_level.lower()) is not None
 
-def get_priority_level(shipment: Dict[str, Any]) -> str:
-    """Determine shipment priority level"""
+def get_priority_level(shipment: Dict[str, Any], today: Optional[date] = None) -> str:
+    """
+    Determine shipment priority level
+    Callers scoring a list can pass today once instead of reading the clock per shipment
+    """
     try:
         # Check service level
-        service_level = shipment.get('TFST_Service_Level__c', '').lower()
-        if 'urgent' in service_level or 'critical' in service_level:
+        if _is_urgent_service_level(shipment.get('TFST_Service_Level__c', '')):
             return 'high'
         
         # Check if it's on critical path
@@ -195,16 +280,16 @@ def get_priority_level(shipment: Dict[str, Any]) -> str:
         # Check delivery date proximity
         delivery_date = shipment.get('Required_Delivery_Date__c')
         if delivery_date:
-            from datetime import datetime, timedelta
             try:
-                delivery_datetime = datetime.strptime(delivery_date, '%Y-%m-%d')
-                days_until_delivery = (delivery_datetime.date() - datetime.now().date()).days
+                if today is None:
+                    today = datetime.now().date()
+                days_until_delivery = (date.fromisoformat(delivery_date) - today).days
                 
                 if days_until_delivery <= 1:
                     return 'high'
                 elif days_until_delivery <= 3:
                     return 'medium'
-            except:
+            except (TypeError, ValueError):
                 pass
         
         return 'normal'
@@ -228,16 +313,16 @@ def truncate_text(text: str, max_length: int = 100) -> str:
     if not text:
         return ""
     
-    if len(text) <= max_length:
-        return text
-    
-    return text[:max_length-3] + "..."
+    return text if len(text) <= max_length else text[:max_length-3] + "..."
 
 def is_json_request(request):
     """Check if request expects JSON response"""
-    return (request.headers.get('Content-Type', '').startswith('application/json') or
-            request.headers.get('Accept', '').startswith('application/json') or
-            request.is_json)
+    # is_json already covers the Content-Type header; HTML is listed first so
+    # wildcard Accept headers from browsers and curl keep getting pages
+    if request.is_json:
+        return True
+    
+    return request.accept_mimetypes.best_match(('text/html', 'application/json')) == 'application/json'
 
 def log_user_activity(user_id: int, activity: str, details: str = None):
     """Log user activity for audit trail"""
@@ -286,20 +371,18 @@ def create_success_response(data: Any = None, message: str = None) -> Dict:
 
 def validate_email(email: str) -> bool:
     """Basic email validation"""
-    import re
-    
-    if not email:
+    if not email or '@' not in email:
         return False
     
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(email_pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 def get_client_ip(request):
     """Get client IP address from request"""
-    # Check for forwarded IP (proxy/load balancer)
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    elif request.headers.get('X-Real-IP'):
-        return request.headers.get('X-Real-IP')
-    else:
-        return request.remote_addr
\ No newline at end of file
+    headers = request.headers
+    
+    # Check for forwarded IP (proxy/load balancer); the first hop is the client
+    forwarded_for = headers.get('X-Forwarded-For')
+    if forwarded_for:
+        return forwarded_for.partition(',')[0].strip()
+    
+    return headers.get('X-Real-IP') or request.remote_addr
\ No newline at end of file
@@ -23,6 +23,10 @@ class Config:
     SALESFORCE_LOGIN_URL = os.environ.get('SALESFORCE_LOGIN_URL', 'https://login.salesforce.com')
     SALESFORCE_REDIRECT_URI = os.environ.get('SALESFORCE_REDIRECT_URI', 'http://localhost:5000/auth/callback')
     
+    # Buffer tracking records and create them in batches instead of one API call each
+    TRACKING_BATCH_ENABLED = os.environ.get('TRACKING_BATCH_ENABLED', 'False').lower() in ('true', '1', 't')
+    TRACKING_BATCH_INTERVAL = float(os.environ.get('TRACKING_BATCH_INTERVAL', 5))
+    
     # Firebase Configuration
     FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID', 'ftl-mobileapp')
     FIREBASE_PRIVATE_KEY_ID = os.environ.get('FIREBASE_PRIVATE_KEY_ID', '4b6927357df18555c42290d66d1ac0e459c7f79e')
@@ -50,11 +54,21 @@ class Config:
     # Upload Configuration
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file upload
     UPLOAD_FOLDER = 'uploads'
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'csv'}
+    ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'pdf', 'csv'})
     
     # Redis Configuration (for caching if needed)
     REDIS_URL = os.environ.get('REDIS_URL')
     
+    # WebSocket Configuration
+    # Flask-SocketIO async mode ('eventlet', 'gevent' or 'threading'); unset picks the best one installed
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+    # Pub/sub queue that lets every worker reach clients connected to the others; defaults to REDIS_URL
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or REDIS_URL
+    # Comma-separated origins allowed to open sockets; unset allows only the portal's own origin
+    SOCKETIO_CORS_ALLOWED_ORIGINS = [o.strip() for o in os.environ.get('SOCKETIO_CORS_ALLOWED_ORIGINS', '').split(',') if o.strip()] or None
+    # Per-packet Socket.IO/Engine.IO logging; too chatty to leave on under real traffic
+    SOCKETIO_DEBUG = os.environ.get('SOCKETIO_DEBUG', 'False').lower() in ('true', '1', 't')
+    
     # Logging Configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
@@ -1,6 +1,8 @@
 """
 Temporary test route to redirect Salesforce OAuth to our debug endpoint
 """
+from urllib.parse import urlencode
+
 from flask import Blueprint, redirect, request
 
 test_bp = Blueprint('test', __name__)
@@ -8,11 +10,8 @@ test_bp = Blueprint('test', __name__)
 @test_bp.route('/auth/callback')
 def redirect_to_debug():
     """Temporarily redirect OAuth callback to debug version"""
-    # Get all parameters from the original callback
-    args = dict(request.args)
-    
-    # Build query string
-    query_string = '&'.join([f"{k}={v}" for k, v in args.items()])
+    # Forward all parameters from the original callback, properly encoded
+    query_string = urlencode(list(request.args.items(multi=True)))
     
     # Redirect to debug callback
     return redirect(f'/auth/callback-debug?{query_string}')